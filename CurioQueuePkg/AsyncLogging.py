@@ -0,0 +1,195 @@
+"""
+AsyncLogging.py - Keep logging off the event loop.
+
+With the usual handlers every record is formatted and written to disk by
+the task that logged it, stalling the curio scheduler.  Here the root
+logger only puts the record, unformatted, on an in-process queue.  A
+background thread takes the records off in batches, formats the ones the
+real handlers accept, writes them and flushes each handler once per batch.
+"""
+
+import atexit
+from logging import Handler, LogRecord, StreamHandler, getLogger
+from logging.handlers import QueueHandler
+from queue import Empty, SimpleQueue
+from threading import Thread
+from time import monotonic
+from typing import List
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+_listener = None
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue records as they are, leaving the message to be formatted by the
+    background writer, and only if a handler actually wants the record.
+    """
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        """
+        Pass the record through untouched.  The queue never leaves this
+        process, so there is no need to make the record picklable.
+
+        :param record: record being logged
+        :return: the same record
+        """
+        return record
+
+
+class BatchingQueueListenerClass:
+    """
+    Background thread that hands queued records to the real handlers in
+    batches.
+    """
+
+    def __init__(self, record_queue: SimpleQueue, handlers: List[Handler],
+                 batch_size: int = 256, flush_interval: float = 0.5):
+        """
+        Set up the listener.  Call start to begin writing.
+
+        :param record_queue: queue the DeferredQueueHandler writes to
+        :param handlers: handlers that do the real output
+        :param batch_size: most records written before a flush
+        :param flush_interval: longest time in seconds a record waits
+            for its batch to fill
+        """
+        self.record_queue = record_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.thread = None
+        return
+
+    def start(self):
+        """
+        Start the writer thread.
+
+        :return:
+        """
+        self.thread = Thread(target=self._write_records,
+                             name='AsyncLoggingWriter', daemon=True)
+        self.thread.start()
+        return
+
+    def stop(self):
+        """
+        Write out everything queued so far and stop the writer thread.
+
+        :return:
+        """
+        if self.thread is not None:
+            self.record_queue.put(None)
+            self.thread.join()
+            self.thread = None
+        return
+
+    def _write_records(self):
+        """
+        Gather records into batches and write them until told to stop.
+
+        :return:
+        """
+        stopping = False
+        while not stopping:
+            batch = [self.record_queue.get()]
+            flush_at = monotonic() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size and batch[-1] is not None:
+                    batch.append(self.record_queue.get(
+                        timeout=max(flush_at - monotonic(), 0)))
+            except Empty:
+                pass
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+            for handler in self.handlers:
+                self._write_batch(handler, batch)
+        return
+
+    @staticmethod
+    def _write_batch(handler: Handler, batch: List[LogRecord]):
+        """
+        Write a batch through one handler, flushing once at the end where
+        the handler allows it.
+
+        :param handler: handler to write through
+        :param batch: records to write
+        :return:
+        """
+        wanted = [record for record in batch
+                  if record.levelno >= handler.level and
+                  handler.filter(record)]
+        if not wanted:
+            return
+        stream = getattr(handler, 'stream', None)
+        if not isinstance(handler, StreamHandler) or stream is None:
+            for record in wanted:
+                handler.handle(record)
+            return
+        handler.acquire()
+        try:
+            for record in wanted:
+                try:
+                    stream.write(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            handler.flush()
+        finally:
+            handler.release()
+        return
+
+
+def start_async_logging(batch_size: int = 256,
+                        flush_interval: float = 0.5
+                        ) -> BatchingQueueListenerClass:
+    """
+    Move the root logger's handlers behind a queue and a writer thread.
+    Everything queued is written out when the program exits.
+
+    :param batch_size: most records written before a flush
+    :param flush_interval: longest wait in seconds for a batch to fill
+    :return: the listener running the writer thread
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    root = getLogger()
+    handlers = list(root.handlers)
+    record_queue = SimpleQueue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(record_queue))
+    _listener = BatchingQueueListenerClass(record_queue, handlers,
+                                           batch_size=batch_size,
+                                           flush_interval=flush_interval)
+    _listener.start()
+    atexit.register(stop_async_logging)
+    return _listener
+
+
+def stop_async_logging():
+    """
+    Write out everything queued and put the original handlers back on the
+    root logger.
+
+    :return:
+    """
+    global _listener
+    if _listener is None:
+        return
+    root = getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DeferredQueueHandler):
+            root.removeHandler(handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
+    return
+
+# EOF
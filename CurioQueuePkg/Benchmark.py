@@ -0,0 +1,372 @@
+"""
+Benchmark.py - Measure the CurioQueue word pipeline and catch regressions.
+
+Runs PlayCurioClass.run_pipeline over a synthetic corpus: words are sent
+through the producer as fast as the all_word_queue takes them, checked by
+the word_check tasks and passed on to the good_word_queue.  For each run it
+reports messages per second, the 50th/95th/99th percentile check latency
+(from a word being numbered to word_check passing it on, so not the time
+to reach the collector and word sink), the peak RSS and the number of curio
+task switches.  Each run is made in a fresh process, so the peak RSS is
+that run's own.  Results are saved as JSON so later runs can be compared
+against them::
+
+    python -m CurioQueuePkg.Benchmark run --words 20000 --out base.json
+    python -m CurioQueuePkg.Benchmark run --words 20000 --out new.json
+    python -m CurioQueuePkg.Benchmark compare base.json new.json
+
+compare exits with status 1 if any figure got worse by more than the
+threshold.
+"""
+
+import json
+import os
+import platform
+import resource
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+from multiprocessing import get_context
+from random import Random
+from statistics import median
+from time import perf_counter
+from typing import List
+
+from curio import run
+from curio.kernel import Activation
+
+from CurioQueuePkg.CurioQueue import PlayCurioClass
+from CurioQueuePkg.HunSpellChecker import CheckMode
+from CurioQueuePkg.WordSink import CountsSinkClass
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+# words the synthetic vocabulary is grown from
+BASE_WORDS = ('good', 'baad', 'ugly', 'gross', 'albatross', 'easparate',
+              'gem', 'clock', 'quantum', 'bathymetry', 'silly', 'queue',
+              'kernel', 'task', 'message', 'spell', 'number', 'word',
+              'check', 'produce', 'consume', 'signal', 'thread', 'process',
+              'memory', 'letter', 'window', 'garden', 'river', 'mountain',
+              'yellow', 'orange', 'purple', 'simple', 'quick', 'brown',
+              'jump', 'lazy', 'dog', 'house')
+SUFFIXES = ('s', 'ed', 'ing', 'er', 'ly')
+
+# figure name, True if bigger is better
+METRICS = (('messages_per_second', True),
+           ('check_latency_p50', False),
+           ('check_latency_p95', False),
+           ('check_latency_p99', False),
+           ('peak_rss_bytes', False),
+           ('scheduler_switches', False))
+
+
+class SwitchCounterClass(Activation):
+    """
+    Count how many times the curio kernel switches to a task.
+    """
+
+    def __init__(self):
+        """
+        Start from zero.
+        """
+        self.switches = 0
+        return
+
+    def running(self, task):
+        """
+        Count a task being switched in.
+        """
+        self.switches += 1
+
+
+class BenchPlayCurioClass(PlayCurioClass):
+    """
+    PlayCurioClass that remembers when each word was numbered and how long
+    it took to get through word_check (its check latency).
+    """
+
+    def __init__(self, corpus: List[str], **kwargs):
+        """
+        Set up the pipeline for a corpus.
+
+        :param corpus: words to send through the pipeline
+        :param kwargs: passed on to PlayCurioClass
+        """
+        super().__init__(**kwargs)
+        self.corpus = corpus
+        self.sent_at = []
+        self.latencies = []
+        return
+
+    def number_word(self, word: str) -> tuple:
+        """
+        Number the word and note when it was sent.
+
+        :param word: word to number
+        :return: (sequence number, word)
+        """
+        self.sent_at.append(perf_counter())
+        return super().number_word(word)
+
+    def chunk_checked(self, chunk: list):
+        """
+        Record how long each word of the chunk took.
+
+        :param chunk: (sequence number, word) pairs just handled
+        :return:
+        """
+        now = perf_counter()
+        self.latencies.extend(now - self.sent_at[seq] for seq, word in chunk)
+        super().chunk_checked(chunk)
+        return
+
+    async def feed_corpus(self, batch_size: int = 64):
+        """
+        Send the corpus through word_producer in batches.
+
+        :param batch_size: words handed to the queue at a time
+        :return:
+        """
+        for start in range(0, len(self.corpus), batch_size):
+            await self.word_producer.send_many(
+                [self.number_word(word)
+                 for word in self.corpus[start:start + batch_size]])
+        return
+
+    async def run_benchmark(self) -> float:
+        """
+        Push the whole corpus through the pipeline.
+
+        :return: seconds taken
+        """
+        started = perf_counter()
+        await self.run_pipeline(self.feed_corpus)
+        return perf_counter() - started
+
+
+def make_vocabulary(size: int, rnd: Random) -> List[str]:
+    """
+    Build a vocabulary of real words, inflections and misspellings.
+
+    :param size: number of distinct words wanted
+    :param rnd: random number generator to use
+    :return: list of distinct words
+    """
+    vocabulary = list(dict.fromkeys(BASE_WORDS))[:size]
+    seen = set(vocabulary)
+    while len(vocabulary) < size:
+        word = list(rnd.choice(BASE_WORDS))
+        if rnd.random() < 0.5:
+            word.append(rnd.choice(SUFFIXES))
+        else:
+            first = rnd.randrange(len(word))
+            second = rnd.randrange(len(word))
+            word[first], word[second] = word[second], word[first]
+            word.insert(rnd.randrange(len(word) + 1),
+                        rnd.choice('abcdefghijklmnopqrstuvwxyz'))
+        word = ''.join(word)
+        if word not in seen:
+            seen.add(word)
+            vocabulary.append(word)
+    return vocabulary
+
+
+def make_corpus(words: int, vocabulary_size: int, skew: float,
+                seed: int) -> List[str]:
+    """
+    Draw a corpus from a synthetic vocabulary with a Zipf-like
+    distribution: the word of rank r turns up in proportion to 1 / r**skew.
+
+    :param words: corpus length
+    :param vocabulary_size: distinct words to draw from
+    :param skew: 0 for every word equally likely, larger for a few words
+        repeated more
+    :param seed: random seed, so runs can be repeated
+    :return: the corpus
+    """
+    rnd = Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rnd)
+    weights = [1 / (rank ** skew) for rank in range(1, len(vocabulary) + 1)]
+    return rnd.choices(vocabulary, weights=weights, k=words)
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """
+    Nearest rank percentile of sorted values.
+
+    :param ordered: values in ascending order
+    :param fraction: e.g. 0.95 for the 95th percentile
+    :return: the percentile (0.0 if there are no values)
+    """
+    if not ordered:
+        return 0.0
+    rank = max(int(round(fraction * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def run_once(corpus: List[str], config: dict) -> dict:
+    """
+    Run the pipeline over the corpus in a fresh curio kernel.  Called in a
+    process of its own, so the peak RSS is that of this run alone.
+
+    :param corpus: words to send
+    :param config: pipeline settings from the command line
+    :return: the figures for this run
+    """
+    bench = BenchPlayCurioClass(
+        corpus, check_mode=CheckMode(config['check_mode']),
+        check_workers=config['check_workers'],
+        check_consumers=config['check_consumers'],
+        ordered_output=config['ordered_output'],
+        queue_size=config['queue_size'], word_sink=CountsSinkClass())
+    counter = SwitchCounterClass()
+    with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+        seconds = run(bench.run_benchmark, activations=[counter])
+    latencies = sorted(bench.latencies)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+    figures = dict(messages=len(corpus), seconds=seconds,
+                   messages_per_second=len(corpus) / seconds,
+                   check_latency_p50=percentile(latencies, 0.50),
+                   check_latency_p95=percentile(latencies, 0.95),
+                   check_latency_p99=percentile(latencies, 0.99),
+                   peak_rss_bytes=peak_rss,
+                   scheduler_switches=counter.switches)
+    return figures
+
+
+def run_benchmark(config: dict) -> dict:
+    """
+    Run the benchmark the configured number of times, each in a newly
+    spawned process.
+
+    :param config: settings from the command line
+    :return: the baseline document, with every run and the median figures
+    """
+    corpus = make_corpus(config['words'], config['vocabulary'],
+                         config['skew'], config['seed'])
+    runs = []
+    for _ in range(config['repeat']):
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=get_context('spawn')) as executor:
+            runs.append(executor.submit(run_once, corpus, config).result())
+    results = {name: median(figures[name] for figures in runs)
+               for name, bigger_is_better in METRICS}
+    baseline = dict(benchmark='word_pipeline',
+                    created=datetime.now().isoformat(timespec='seconds'),
+                    python=platform.python_version(),
+                    platform=platform.platform(), config=config,
+                    runs=runs, results=results)
+    return baseline
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """
+    Print the figures side by side and list those that got worse.
+
+    :param old: baseline document to compare against
+    :param new: baseline document from the run being checked
+    :param threshold: relative change allowed, e.g. 0.10 for 10%
+    :return: names of the figures that regressed
+    """
+    if old['config'] != new['config']:
+        print('Warning: the runs were made with different settings')
+    regressions = []
+    for name, bigger_is_better in METRICS:
+        if name not in old['results']:
+            print(f'{name:22} not in the baseline')
+            continue
+        old_value = old['results'][name]
+        new_value = new['results'][name]
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        worse = -change if bigger_is_better else change
+        flag = ''
+        if worse > threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print(f'{name:22} {old_value:16.6g} {new_value:16.6g} '
+              f'{change:+8.1%} {flag}')
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    """
+    Run the benchmark or compare two saved runs.
+
+    :param argv: command line arguments
+    :return: exit status
+    """
+    parser = ArgumentParser(description='Benchmark the word pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('--words', type=int, default=10000,
+                            help='number of words sent')
+    run_parser.add_argument('--vocabulary', type=int, default=1000,
+                            help='number of distinct words')
+    run_parser.add_argument('--skew', type=float, default=1.0,
+                            help='Zipf exponent of word repeats (0 = uniform)')
+    run_parser.add_argument('--seed', type=int, default=2018)
+    run_parser.add_argument('--repeat', type=int, default=3,
+                            help='runs made; the median is reported')
+    run_parser.add_argument('--check-mode', default=CheckMode.INLINE.value,
+                            choices=[mode.value for mode in CheckMode])
+    run_parser.add_argument('--check-workers', type=int, default=4)
+    run_parser.add_argument('--check-consumers', type=int, default=1)
+    run_parser.add_argument('--unordered', action='store_true',
+                            help='pass good words on as soon as checked')
+    run_parser.add_argument('--queue-size', type=int, default=0)
+    run_parser.add_argument('--out', help='file to save the results in')
+    compare_parser = commands.add_parser(
+        'compare', help='compare a run against a baseline')
+    compare_parser.add_argument('baseline', help='earlier results file')
+    compare_parser.add_argument('current', help='later results file')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='relative change allowed (0.10 = 10%%)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.baseline) as baseline_file:
+            old = json.load(baseline_file)
+        with open(args.current) as current_file:
+            new = json.load(current_file)
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s): '
+                  f'{", ".join(regressions)}')
+            return 1
+        return 0
+
+    config = dict(words=args.words, vocabulary=args.vocabulary,
+                  skew=args.skew, seed=args.seed, repeat=args.repeat,
+                  check_mode=args.check_mode,
+                  check_workers=args.check_workers,
+                  check_consumers=args.check_consumers,
+                  ordered_output=not args.unordered,
+                  queue_size=args.queue_size)
+    baseline = run_benchmark(config)
+    results = baseline['results']
+    print(f'{config["words"]} words: '
+          f'{results["messages_per_second"]:.0f} messages/s, check '
+          f'latency p50 {results["check_latency_p50"] * 1000:.3f}ms '
+          f'p95 {results["check_latency_p95"] * 1000:.3f}ms '
+          f'p99 {results["check_latency_p99"] * 1000:.3f}ms, '
+          f'peak RSS per run {results["peak_rss_bytes"] / 2 ** 20:.1f}MiB, '
+          f'{results["scheduler_switches"]} task switches')
+    if args.out:
+        with open(args.out, 'w') as out_file:
+            json.dump(baseline, out_file, indent=2)
+        print(f'Results saved to {args.out}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+
+# EOF
@@ -0,0 +1,132 @@
+"""
+ConcurrentMap.py - Fan a coroutine function out over many items at once.
+
+These are built on curio's TaskGroup.  At most limit calls are in flight
+at any time, and results are streamed back as they become available
+rather than all at the end.
+
+The helpers are asynchronous generators.  If you might stop iterating
+before the end (break, an exception or cancellation) wrap them with
+curio.meta.finalize so the outstanding calls get cancelled promptly::
+
+    async with finalize(map_ordered(corofunc, items)) as results:
+        async for item, result in results:
+            ...
+"""
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Tuple
+
+from curio import TaskGroup
+from curio.meta import finalize
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+
+async def _indexed_call(corofunc: Callable[[Any], Awaitable], index: int,
+                        item: Any) -> Tuple[int, Any, Any]:
+    """
+    Await corofunc(item), remembering where the item came from.
+
+    :param corofunc: coroutine function to call
+    :param index: position of the item in the input
+    :param item: the item
+    :return: index, item and the result of the call
+    """
+    return index, item, await corofunc(item)
+
+
+async def _as_completed_indexed(corofunc: Callable[[Any], Awaitable],
+                                items: Iterable, limit: int
+                                ) -> AsyncIterator[Tuple[int, Any, Any]]:
+    """
+    Run corofunc over the items, yielding (index, item, result) as each
+    call finishes.
+
+    :param corofunc: coroutine function taking one item
+    :param items: items to process
+    :param limit: most calls running at once
+    :return: asynchronous generator of (index, item, result)
+    """
+    if limit < 1:
+        raise ValueError(f'Concurrency limit must be at least 1, not {limit}')
+    async with TaskGroup() as group:
+        running = 0
+        for index, item in enumerate(items):
+            if running >= limit:
+                done = await group.next_done()
+                running -= 1
+                yield done.result
+            await group.spawn(_indexed_call, corofunc, index, item)
+            running += 1
+        while running:
+            done = await group.next_done()
+            running -= 1
+            yield done.result
+
+
+async def as_completed(corofunc: Callable[[Any], Awaitable],
+                       items: Iterable, limit: int = 8
+                       ) -> AsyncIterator[Tuple[Any, Any]]:
+    """
+    Run corofunc over the items with up to limit calls at once, yielding
+    (item, result) in the order the calls finish.
+
+    :param corofunc: coroutine function taking one item
+    :param items: items to process
+    :param limit: most calls running at once
+    :return: asynchronous generator of (item, result)
+    """
+    async with finalize(_as_completed_indexed(corofunc, items,
+                                              limit)) as finished:
+        async for index, item, result in finished:
+            yield item, result
+
+
+async def map_ordered(corofunc: Callable[[Any], Awaitable],
+                      items: Iterable, limit: int = 8
+                      ) -> AsyncIterator[Tuple[Any, Any]]:
+    """
+    Run corofunc over the items with up to limit calls at once, yielding
+    (item, result) in input order.  Each result is passed on as soon as
+    every earlier one is available.
+
+    :param corofunc: coroutine function taking one item
+    :param items: items to process
+    :param limit: most calls running at once
+    :return: asynchronous generator of (item, result)
+    """
+    waiting = {}
+    next_index = 0
+    async with finalize(_as_completed_indexed(corofunc, items,
+                                              limit)) as finished:
+        async for index, item, result in finished:
+            waiting[index] = (item, result)
+            while next_index in waiting:
+                yield waiting.pop(next_index)
+                next_index += 1
+
+
+async def ordered_reduce(corofunc: Callable[[Any], Awaitable],
+                         items: Iterable, function: Callable[[Any, Any], Any],
+                         initial: Any, limit: int = 8) -> Any:
+    """
+    Run corofunc over the items with up to limit calls at once and fold
+    the results together in input order, e.g. for a running total.
+
+    :param corofunc: coroutine function taking one item
+    :param items: items to process
+    :param function: function(accumulated, result) -> new accumulated
+    :param initial: starting value
+    :param limit: most calls running at once
+    :return: the final accumulated value
+    """
+    accumulated = initial
+    async with finalize(map_ordered(corofunc, items, limit)) as results:
+        async for item, result in results:
+            accumulated = function(accumulated, result)
+    return accumulated
+
+# EOF
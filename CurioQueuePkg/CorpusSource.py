@@ -0,0 +1,211 @@
+"""
+CorpusSource.py - Stream the words of a large text file into the pipeline.
+
+A file is memory mapped and scanned in place, so only the pages being
+tokenized are resident.  Standard input cannot be mapped and is read in
+large chunks instead.  Either way the text is decoded as UTF-8 and split
+into words, letters of any script, on a worker thread so the event loop is
+not held up, and the words come out in batches that are sent through a
+CurioQueueProducerClass.  With a bounded all_word_queue the sender waits
+whenever the checkers fall behind, so memory use does not grow with the
+size of the input.
+"""
+
+import codecs
+import mmap
+import re
+import sys
+from functools import partial
+from logging import debug
+from threading import Lock
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+
+from curio import run_in_thread
+from curio.meta import finalize
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+STDIN_NAME = '-'
+
+# letters only, in any script, with inner apostrophes as in "don't"
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+# a word that may carry on into the next chunk
+TRAILING_PATTERN = re.compile(r"(?:[^\W\d_]|')+\Z")
+
+
+def iter_text_batches(chunks: Iterable[bytes],
+                      batch_size: int) -> Iterator[List[str]]:
+    """
+    Decode chunks of UTF-8 text and yield their words in batches.  A
+    character or word split across two chunks is put back together.
+
+    :param chunks: the input, in order
+    :param batch_size: words per batch
+    :return: generator of lists of words
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = []
+    tail = ''
+    for chunk in chunks:
+        words, tail = split_words(tail + decoder.decode(chunk))
+        pending.extend(words)
+        while len(pending) >= batch_size:
+            yield pending[:batch_size]
+            del pending[:batch_size]
+    words, tail = split_words(tail + decoder.decode(b'', final=True),
+                              final=True)
+    pending.extend(words)
+    while pending:
+        yield pending[:batch_size]
+        del pending[:batch_size]
+    return
+
+
+def iter_mmap_batches(path: str, batch_size: int,
+                      chunk_size: int = 1 << 20) -> Iterator[List[str]]:
+    """
+    Memory map a file and yield its words in batches.
+
+    :param path: file to read
+    :param batch_size: words per batch
+    :param chunk_size: bytes decoded at a time
+    :return: generator of lists of words
+    """
+    with open(path, 'rb') as corpus_file:
+        try:
+            mapped = mmap.mmap(corpus_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return
+        with mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            chunks = (mapped[start:start + chunk_size]
+                      for start in range(0, len(mapped), chunk_size))
+            yield from iter_text_batches(chunks, batch_size)
+    return
+
+
+def split_words(text: str, final: bool = False) -> Tuple[List[str], str]:
+    """
+    Split a chunk of input into words, holding back a word that may be cut
+    off at the end until the next chunk completes it.
+
+    :param text: the rest of the previous chunk followed by the new one
+    :param final: True if no more input follows
+    :return: the complete words and the text to carry into the next chunk
+    """
+    cut = len(text)
+    if not final:
+        trailing = TRAILING_PATTERN.search(text)
+        if trailing:
+            cut = trailing.start()
+    words = WORD_PATTERN.findall(text, 0, cut)
+    return words, text[cut:]
+
+
+def _next_batch(batches: Iterator[List[str]],
+                batches_lock: Lock) -> Optional[List[str]]:
+    """
+    Read the next batch.  Runs on a worker thread.
+
+    :param batches: generator of batches
+    :param batches_lock: held while the generator runs
+    :return: the batch, or None at the end of the input
+    """
+    with batches_lock:
+        return next(batches, None)
+
+
+def _close_batches(batches: Iterator[List[str]], batches_lock: Lock):
+    """
+    Close a generator of batches, waiting for a read still running on
+    another thread to finish first.  Runs on a worker thread.
+
+    :param batches: generator of batches
+    :param batches_lock: held while the generator runs
+    :return:
+    """
+    with batches_lock:
+        batches.close()
+    return
+
+
+class CorpusSourceClass:
+    """
+    Source stage that streams the words of a file, or of standard input,
+    into the word pipeline.
+    """
+
+    def __init__(self, path: str = STDIN_NAME, chunk_size: int = 1 << 20,
+                 batch_size: int = 256):
+        """
+        Set up the source.  Nothing is read until send_words runs.
+
+        :param path: text file to read, or '-' for standard input
+        :param chunk_size: bytes read and decoded at a time
+        :param batch_size: words sent to the queue at a time
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.words_read = 0
+        return
+
+    async def word_batches(self) -> AsyncIterator[List[str]]:
+        """
+        Yield the words of the input in batches of batch_size.  Iterate
+        inside curio's finalize, so the input is closed as soon as the
+        reader stops.
+
+        :return: asynchronous generator of lists of words
+        """
+        if self.path == STDIN_NAME:
+            chunks = iter(partial(sys.stdin.buffer.read, self.chunk_size),
+                          b'')
+            batches = iter_text_batches(chunks, self.batch_size)
+        else:
+            batches = iter_mmap_batches(self.path, self.batch_size,
+                                        self.chunk_size)
+        # reading and tokenizing happen on a worker thread, a batch at a time
+        batches_lock = Lock()
+        try:
+            while True:
+                batch = await run_in_thread(_next_batch, batches,
+                                            batches_lock)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            # release the file and its mapping even if the reader gave up,
+            # once a batch still being read for it is done
+            await run_in_thread(_close_batches, batches, batches_lock)
+
+    async def send_words(self, producer, number_word=None):
+        """
+        Send every word of the input through a producer, waiting whenever
+        its queue is full.
+
+        :param producer: a started CurioQueueProducerClass
+        :param number_word: function applied to each word before it is
+            sent, e.g. PlayCurioClass.number_word (None to send the words
+            as they are)
+        :return:
+        """
+        debug('Streaming words from %s', self.path)
+        async with finalize(self.word_batches()) as batches:
+            async for batch in batches:
+                if number_word is not None:
+                    batch = [number_word(word) for word in batch]
+                await producer.send_many(batch)
+                self.words_read += len(batch)
+        debug('Finished streaming %d words from %s', self.words_read,
+              self.path)
+        return
+
+# EOF
@@ -5,19 +5,36 @@ This edition uses a curio queue to pass the words to the spell checker.
 """
 
 import os
+import sys
 # import logging
+from collections import deque
+from itertools import count
+from time import monotonic
 from enum import Enum
+from typing import Iterable, List, Optional, Tuple
 from logging.config import dictConfig
 from logging import basicConfig, getLogger
 from logging import debug, info
 import yaml  # from PyYAML library
 
-from curio import run, spawn, TaskGroup, sleep, Queue
+from curio import run, spawn, TaskGroup, Queue, Lock
+from curio import TaskTimeout, timeout_after
 from curio.debug import schedtrace
-from functools import reduce
-from operator import mul
 
-from CurioQueuePkg.HunSpellChecker import HunSpellCheckerClass
+from CurioQueuePkg.AsyncLogging import start_async_logging
+from CurioQueuePkg.CorpusSource import CorpusSourceClass
+from CurioQueuePkg.DictionaryRegistry import get_registry
+from CurioQueuePkg.FibCompute import ComputeKind, compute
+from CurioQueuePkg.HunSpellChecker import CheckMode, HunSpellCheckerClass
+from CurioQueuePkg.HunSpellChecker import HunSpellSuggesterClass
+from CurioQueuePkg.HunSpellChecker import HunSpellWorkerPoolClass
+from CurioQueuePkg.LatencyHistogram import LatencyHistogramClass
+from CurioQueuePkg.LruCache import LruCacheClass
+from CurioQueuePkg.MetricsServer import MetricsServerClass
+from CurioQueuePkg.SchedTrace import RingTraceClass, TraceMode
+from CurioQueuePkg.WordSink import ConsoleSinkClass, CountsSinkClass
+from CurioQueuePkg.WordSink import SinkKind, WordSinkClass, make_sink
+from CurioQueuePkg.WorkerPool import get_shared_pool
 
 __author__ = 'Travis Risner'
 __project__ = "PlayCurio"
@@ -28,6 +45,17 @@ log = None
 
 node_name = 'localhost'
 
+# queue capacity used when streaming a corpus, so the source waits for the
+# spell checkers rather than reading the whole input into the queue
+CORPUS_QUEUE_SIZE = 4096
+
+# capacity of suggest_word_queue; rejected words that do not fit are not
+# looked up, so that suggestions never hold up the spell checks
+SUGGEST_QUEUE_SIZE = 1024
+
+# sequence numbers for message envelopes, unique across all queues
+_envelope_seq = count()
+
 
 class CurioQueueStatus(Enum):
     """
@@ -38,17 +66,208 @@ class CurioQueueStatus(Enum):
     QUEUE_ERROR = 'error'
 
 
+class CurioQueueClosedError(RuntimeError):
+    """
+    Raised when sending to a closed queue, or when receiving from one that
+    is closed and has no messages left.
+    """
+    pass
+
+
+class MessageEnvelopeClass:
+    """
+    Wrapper carrying a message through a queue along with its sequence
+    number and the monotonic times it was queued and taken off again.
+    """
+    __slots__ = ('seq', 'payload', 'enqueued', 'dequeued')
+
+    def __init__(self, payload):
+        """
+        Wrap a message as it is queued.
+
+        :param payload: the message itself
+        """
+        self.seq = next(_envelope_seq)
+        self.payload = payload
+        self.enqueued = monotonic()
+        self.dequeued = 0.0
+        return
+
+
+class CurioMeteredQueueClass(Queue):
+    """
+    A curio queue that keeps track of how deep it gets and how long
+    producers spend waiting for room when it is full.
+
+    The queue can also be closed.  After that nothing more may be put on
+    it, and once the remaining messages have been taken every waiting or
+    later get raises CurioQueueClosedError.
+
+    Messages sent in envelopes (see MessageEnvelopeClass) also have the
+    time they spent waiting in the queue, and the time the consumer took
+    to deal with them, counted into a pair of histograms.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        """
+        Set up the queue and its counters.
+
+        :param maxsize: most messages held before put waits (0 = no limit)
+        """
+        super().__init__(maxsize=maxsize)
+        self.status = CurioQueueStatus.QUEUE_OPEN
+        self.high_watermark = 0
+        self.put_count = 0
+        self.put_blocked_count = 0
+        self.put_blocked_time = 0.0
+        self.wait_histogram = LatencyHistogramClass()
+        self.service_histogram = LatencyHistogramClass()
+        return
+
+    async def put(self, item):
+        """
+        Add an item, waiting for room if the queue is full.
+
+        :param item: item to add
+        :return:
+        """
+        started = None
+        while True:
+            if self.status != CurioQueueStatus.QUEUE_OPEN:
+                raise CurioQueueClosedError('Queue is closed')
+            if not self.full():
+                break
+            if started is None:
+                started = monotonic()
+            await self._put_waiting.suspend('QUEUE_PUT')
+        self._put_item(item)
+        self._task_count += 1
+        if self._get_waiting:
+            await self._get_waiting.wake()
+        if started is not None:
+            self.put_blocked_count += 1
+            self.put_blocked_time += monotonic() - started
+        self.put_count += 1
+        self.high_watermark = max(self.high_watermark, self.qsize())
+        return
+
+    async def get(self):
+        """
+        Take the next item, waiting for one if the queue is empty.
+
+        :return: the item
+        """
+        must_wait = bool(self._get_waiting)
+        while must_wait or self.empty():
+            if self.empty() and self.status != CurioQueueStatus.QUEUE_OPEN:
+                raise CurioQueueClosedError('Queue is closed and empty')
+            must_wait = False
+            await self._get_waiting.suspend('QUEUE_GET')
+        result = self._get_item()
+        if self._put_waiting:
+            await self._put_waiting.wake()
+        return result
+
+    async def close(self):
+        """
+        Close the queue and wake every task waiting on it so that they can
+        see it is closed.  Messages already queued can still be taken.
+
+        :return:
+        """
+        if self.status == CurioQueueStatus.QUEUE_OPEN:
+            self.status = CurioQueueStatus.QUEUE_CLOSED
+        if self._get_waiting:
+            await self._get_waiting.wake(len(self._get_waiting))
+        if self._put_waiting:
+            await self._put_waiting.wake(len(self._put_waiting))
+        return
+
+    def queue_stats(self) -> dict:
+        """
+        Report the queue counters.
+
+        :return: dictionary of depth, capacity and put counters
+        """
+        stats = dict(status=self.status.value, depth=self.qsize(),
+                     maxsize=self.maxsize, high_watermark=self.high_watermark,
+                     put_count=self.put_count,
+                     put_blocked_count=self.put_blocked_count,
+                     put_blocked_time=self.put_blocked_time)
+        return stats
+
+    def latency_stats(self) -> dict:
+        """
+        Summarise the queue wait and service time histograms.
+
+        :return: dictionary of histogram summaries in seconds
+        """
+        stats = dict(queue_wait=self.wait_histogram.summary(),
+                     service=self.service_histogram.summary())
+        return stats
+
+
+def queue_status(curio_queue: Queue) -> CurioQueueStatus:
+    """
+    Report whether a queue is open or closed.  Plain curio queues cannot
+    be closed, so they are always open.
+
+    :param curio_queue: queue to report on (a curio queue, a
+        CurioMeteredQueueClass or a QueueBroker.BrokerQueueClass)
+    :return: the state of the queue
+    """
+    return getattr(curio_queue, 'status', CurioQueueStatus.QUEUE_OPEN)
+
+
+def queue_stats(curio_queue: Queue) -> dict:
+    """
+    Report the counters of a queue, or just its depth and capacity if it
+    is a plain curio queue.
+
+    :param curio_queue: queue to report on
+    :return: dictionary of queue counters
+    """
+    if hasattr(curio_queue, 'queue_stats'):
+        return curio_queue.queue_stats()
+    return dict(depth=curio_queue.qsize(), maxsize=curio_queue.maxsize)
+
+
+def _latency_histograms(curio_queue: Queue) -> tuple:
+    """
+    Find the histograms envelope timings are counted into.
+
+    :param curio_queue: queue the messages went through
+    :return: the queue wait and service histograms (None, None for a
+        plain curio queue)
+    """
+    return (getattr(curio_queue, 'wait_histogram', None),
+            getattr(curio_queue, 'service_histogram', None))
+
+
 class CurioQueueProducerClass:
     """
     Provide a class to submit an entry to a curio queue and hide all the
     details.
+
+    A producer is meant to be started once and used for as many messages
+    as needed.  Sending never waits for the consumers to catch up.
     """
 
-    def __init__(self, curio_queue: Queue):
+    def __init__(self, curio_queue: Queue = None, maxsize: int = 0,
+                 envelopes: bool = False):
         """
         Provide placeholders for the the producer.
+
+        :param curio_queue: queue to use, or None to create a new one
+        :param maxsize: capacity of a newly created queue (0 = no limit);
+            when full, sending waits until a consumer makes room
+        :param envelopes: send each message in a MessageEnvelopeClass so
+            its queue wait and service times are measured
         """
+        if curio_queue is None:
+            curio_queue = CurioMeteredQueueClass(maxsize=maxsize)
         self.queue = curio_queue
+        self.envelopes = envelopes
         self.status = CurioQueueStatus.QUEUE_CLOSED
         return
 
@@ -59,7 +278,7 @@ class CurioQueueProducerClass:
         :return:
         """
         if self.status != CurioQueueStatus.QUEUE_OPEN:
-            self.status = CurioQueueStatus.QUEUE_OPEN
+            self.status = queue_status(self.queue)
         return
 
     async def send_message(self, msg: str):
@@ -71,38 +290,147 @@ class CurioQueueProducerClass:
         """
         msg_to_send = msg
         if self.status == CurioQueueStatus.QUEUE_OPEN:
+            if self.envelopes:
+                msg = MessageEnvelopeClass(msg)
             try:
                 await self.queue.put(msg)
+            except CurioQueueClosedError:
+                self.status = CurioQueueStatus.QUEUE_CLOSED
+                raise
+            except RuntimeError as xcp:
+                debug('Unable to send message: %s', msg_to_send, exc_info=xcp)
+                self.status = CurioQueueStatus.QUEUE_ERROR
+                raise
+        return
+
+    async def send_many(self, msgs: Iterable[str]):
+        """
+        Insert a batch of messages into the queue.
+
+        The status check and error handling are done once for the whole
+        batch.  The consumers are only woken for the first message, so the
+        batch costs about one trip through the scheduler unless the queue
+        fills up.
+
+        :param msgs: words to add to queue
+        :return:
+        """
+        msgs_to_send = list(msgs)
+        if self.status == CurioQueueStatus.QUEUE_OPEN:
+            if self.envelopes:
+                msgs_to_send = [MessageEnvelopeClass(msg)
+                                for msg in msgs_to_send]
+            try:
+                for msg in msgs_to_send:
+                    await self.queue.put(msg)
+            except CurioQueueClosedError:
+                self.status = CurioQueueStatus.QUEUE_CLOSED
+                raise
             except RuntimeError as xcp:
-                debug(f'Unable to send message: {msg_to_send}', exc_info=xcp)
+                debug('Unable to send %d messages', len(msgs_to_send),
+                      exc_info=xcp)
+                self.status = CurioQueueStatus.QUEUE_ERROR
                 raise
         return
 
     async def producer_stop(self):
         """
-        Close queue after discarding any remaining values.
+        Stop sending messages.  This does not wait for the consumers.
 
         :return:
         """
-        await self.queue.join()
         self.status = CurioQueueStatus.QUEUE_CLOSED
         return
 
+    async def producer_close(self):
+        """
+        Close the queue itself, for every producer and consumer using it.
+        Consumers still receive the messages already queued and then see
+        the queue as closed.
+
+        :return:
+        """
+        await self.queue.close()
+        self.status = CurioQueueStatus.QUEUE_CLOSED
+        return
+
+    async def producer_join(self):
+        """
+        Wait until every message put on the queue has been acknowledged
+        by a consumer.
+
+        :return:
+        """
+        await self.queue.join()
+        return
+
+    def queue_stats(self) -> dict:
+        """
+        Report the counters of the underlying queue.
+
+        :return: dictionary of queue counters
+        """
+        return queue_stats(self.queue)
+
 
 class CurioQueueConsumerClass:
     """
     Provide a class to retrieve an entry from a curio queue and hide
     all the details.
+
+    Every message retrieved should be acknowledged with message_done once
+    it has been dealt with, in the order received.  Messages that arrive
+    in envelopes are unwrapped; their time in the queue is recorded as
+    they are received and their service time when they are acknowledged.
     """
 
-    def __init__(self, curio_queue: Queue):
+    def __init__(self, curio_queue: Queue = None, maxsize: int = 0):
         """
         Provide placeholders for the the producer.
+
+        :param curio_queue: queue to use, or None to create a new one
+        :param maxsize: capacity of a newly created queue (0 = no limit);
+            when full, sending waits until a consumer makes room
         """
+        if curio_queue is None:
+            curio_queue = CurioMeteredQueueClass(maxsize=maxsize)
         self.queue = curio_queue
         self.status = CurioQueueStatus.QUEUE_CLOSED
+        self.wait_histogram, self.service_histogram = _latency_histograms(
+            curio_queue)
+        self.in_service = deque()
         return
 
+    def _unwrap(self, msg):
+        """
+        Take a message out of its envelope, noting how long it waited.
+
+        :param msg: message as taken off the queue
+        :return: the message as sent
+        """
+        if not isinstance(msg, MessageEnvelopeClass):
+            return msg
+        msg.dequeued = monotonic()
+        if self.wait_histogram is not None:
+            self.wait_histogram.record(msg.dequeued - msg.enqueued)
+        self.in_service.append(msg.dequeued)
+        return msg.payload
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        """
+        Retrieve the next message, ending the iteration once the queue is
+        closed and drained.
+
+        :return: the message received
+        """
+        msg_received = await self.get_message()
+        if self.status != CurioQueueStatus.QUEUE_OPEN:
+            raise StopAsyncIteration
+        return msg_received
+
     async def consumer_start(self):
         """
         Open queue for messages.
@@ -117,40 +445,230 @@ class CurioQueueConsumerClass:
         """
         Retrieve a message from the queue.
 
-        :return: the message received or None
+        :return: the message received or None once the queue is closed
+            and drained
         """
         msg_received = None
         if self.status == CurioQueueStatus.QUEUE_OPEN:
             try:
-                msg_received = await self.queue.get()
+                msg_received = self._unwrap(await self.queue.get())
+            except CurioQueueClosedError:
+                self.status = CurioQueueStatus.QUEUE_CLOSED
             except RuntimeError as xcp:
                 debug(f'Unable to retrieve message.', exc_info=xcp)
+                self.status = CurioQueueStatus.QUEUE_ERROR
                 raise
         return msg_received
 
+    async def get_many(self, max_items: int,
+                       timeout: Optional[float] = None) -> List[str]:
+        """
+        Retrieve a batch of messages from the queue.
+
+        Wait (up to timeout seconds, or forever if None) for the first
+        message, then take whatever else is already queued without waiting
+        again, up to max_items in all.
+
+        :param max_items: most messages to return
+        :param timeout: seconds to wait for the first message
+        :return: the messages received (empty if the timeout expired or
+            the queue is closed and drained)
+        """
+        msgs_received = []
+        if self.status == CurioQueueStatus.QUEUE_OPEN:
+            try:
+                if timeout is None:
+                    msgs_received.append(self._unwrap(await self.queue.get()))
+                else:
+                    msgs_received.append(self._unwrap(
+                        await timeout_after(timeout, self.queue.get)))
+                while (len(msgs_received) < max_items and
+                       not self.queue.empty()):
+                    msgs_received.append(self._unwrap(await self.queue.get()))
+            except TaskTimeout:
+                pass
+            except CurioQueueClosedError:
+                self.status = CurioQueueStatus.QUEUE_CLOSED
+            except RuntimeError as xcp:
+                debug(f'Unable to retrieve messages.', exc_info=xcp)
+                self.status = CurioQueueStatus.QUEUE_ERROR
+                raise
+        return msgs_received
+
+    async def message_done(self, count: int = 1):
+        """
+        Acknowledge messages retrieved from the queue.
+
+        :param count: number of messages that have been dealt with
+        :return:
+        """
+        if self.in_service:
+            done = monotonic()
+            for _ in range(min(count, len(self.in_service))):
+                dequeued = self.in_service.popleft()
+                if self.service_histogram is not None:
+                    self.service_histogram.record(done - dequeued)
+        for _ in range(count):
+            await self.queue.task_done()
+        return
+
     async def consumer_stop(self):
         """
-        Close queue after discarding any remaining values.
+        Stop retrieving messages.
 
         :return:
         """
-        await self.queue.task_done()
         self.status = CurioQueueStatus.QUEUE_CLOSED
         return
 
+    def queue_stats(self) -> dict:
+        """
+        Report the counters of the underlying queue.
+
+        :return: dictionary of queue counters
+        """
+        return queue_stats(self.queue)
+
+
+class ReorderBufferClass:
+    """
+    Hold results that finish out of order until every earlier sequence
+    number has been seen, then release them in input order.
+    """
+
+    def __init__(self):
+        """
+        Start expecting sequence number zero.
+        """
+        self.next_seq = 0
+        self.pending = {}
+        return
+
+    def add(self, seq: int, item) -> list:
+        """
+        Accept the result for one sequence number.
+
+        :param seq: sequence number assigned when the word was queued
+        :param item: result to release in order (None is dropped)
+        :return: items that are now ready, in order
+        """
+        self.pending[seq] = item
+        ready = []
+        while self.next_seq in self.pending:
+            item = self.pending.pop(self.next_seq)
+            if item is not None:
+                ready.append(item)
+            self.next_seq += 1
+        return ready
+
 
 class PlayCurioClass:
     """
     PlayCurioClass - play with Curio library.
     """
 
-    def __init__(self):
+    # computed results, kept across instances and runs
+    compute_memo = LruCacheClass(max_size=1024)
+
+    def __init__(self, check_mode: CheckMode = CheckMode.INLINE,
+                 check_workers: int = 4, check_consumers: int = 1,
+                 ordered_output: bool = True, queue_size: int = 0,
+                 compute_kind: ComputeKind = ComputeKind.FACTORIAL,
+                 compute_offload_at: int = 50,
+                 corpus_source: Optional[CorpusSourceClass] = None,
+                 word_sink: Optional[WordSinkClass] = None,
+                 snapshot_path: Optional[str] = None,
+                 track_latency: bool = False,
+                 suggest_mode: Optional[CheckMode] = None,
+                 suggest_workers: int = 2, suggest_budget: float = 0.5,
+                 broker_address: Optional[Tuple[str, int]] = None):
+        """
+        Set up the queues and the spell checker.
+
+        :param check_mode: run spell checks inline on the event loop or
+            on a pool of worker threads or processes
+        :param check_workers: size of the worker pool
+        :param check_consumers: number of word_check tasks sharing the
+            all_word_queue
+        :param ordered_output: keep the good words in input order, or
+            pass them on as soon as they are checked
+        :param queue_size: capacity of all_word_queue and good_word_queue
+            (0 = no limit); producers wait while a queue is full
+        :param compute_kind: number worked out by fib (factorial or
+            Fibonacci)
+        :param compute_offload_at: smallest argument that fib hands off to
+            the process pool rather than computing inline
+        :param corpus_source: stream the words of a file or standard input
+            through the pipeline instead of the demo words; give a
+            queue_size so the source waits for the checkers
+        :param word_sink: where the good and rejected words are written
+            (default: the console for the demo words, only counts for a
+            corpus)
+        :param snapshot_path: precompiled word snapshot checked before
+            Hunspell, which is then only loaded for words not in it
+        :param track_latency: send the words in envelopes and keep
+            histograms of how long they wait in each queue and how long
+            they take to deal with
+        :param suggest_mode: look up corrections for the rejected words on
+            worker threads or processes (None for no suggestions)
+        :param suggest_workers: number of suggestion lookups run at once
+        :param suggest_budget: most seconds spent waiting for one word's
+            suggestions
+        :param broker_address: (host, port) of a queue broker holding
+            all_word_queue and good_word_queue, so that word_check tasks
+            in other processes can share the work (see QueueBroker.py);
+            turn ordered_output off when they do
+        """
         self.factor = 10
+        self.compute_kind = compute_kind
+        self.compute_offload_at = compute_offload_at
         debug('PlayCurioClass init started')
-        self.spell_checker = HunSpellCheckerClass()
-        self.all_word_queue = Queue()
-        self.good_word_queue = Queue()
-        self.stop_word = '!!!STOP!!!'
+        if check_mode == CheckMode.INLINE:
+            self.spell_checker = HunSpellCheckerClass(
+                snapshot_path=snapshot_path)
+        else:
+            self.spell_checker = HunSpellWorkerPoolClass(
+                mode=check_mode, workers=check_workers,
+                snapshot_path=snapshot_path)
+        self.check_mode = check_mode
+        self.track_latency = track_latency
+        if broker_address is None:
+            self.broker_client = None
+            self.all_word_queue = CurioMeteredQueueClass(maxsize=queue_size)
+            self.good_word_queue = CurioMeteredQueueClass(maxsize=queue_size)
+        else:
+            # the broker module builds on this one, so import it only here
+            from CurioQueuePkg.QueueBroker import BrokerClientClass
+            self.broker_client = BrokerClientClass(*broker_address)
+            self.all_word_queue = self.broker_client.queue(
+                'all_word_queue', maxsize=queue_size)
+            self.good_word_queue = self.broker_client.queue(
+                'good_word_queue', maxsize=queue_size)
+        self.check_chunk_size = 64
+        self.check_consumers = check_consumers
+        self.ordered_output = ordered_output
+        self.next_seq = 0
+        self.reorder_buffer = ReorderBufferClass()
+        self.reorder_lock = Lock()
+        self.word_producer = None
+        self.words_checked = 0
+        self.good_word_count = 0
+        self.corpus_source = corpus_source
+        if word_sink is None:
+            if corpus_source is None:
+                word_sink = ConsoleSinkClass()
+            else:
+                word_sink = CountsSinkClass()
+        self.word_sink = word_sink
+        if suggest_mode is None:
+            self.suggester = None
+        else:
+            self.suggester = HunSpellSuggesterClass(
+                mode=suggest_mode, workers=suggest_workers,
+                budget=suggest_budget)
+        self.suggest_word_queue = CurioMeteredQueueClass(
+            maxsize=SUGGEST_QUEUE_SIZE)
+        self.suggestions_dropped = 0
         self.raw_word_list = ('good', 'baad', 'ugly', 'gross', 'albatross',
                               'easparate', 'gem', 'clock', 'quantum',
                               'bathymetry', 'silly')
@@ -158,62 +676,162 @@ class PlayCurioClass:
 
     async def fib(self, nbr: int) -> int:
         """
-        Compute Fibonacci numbers (brute force)
+        Compute the factorial or Fibonacci number selected by compute_kind.
+
+        Results are remembered across calls and runs.  Arguments of
+        compute_offload_at or more are computed on the shared warm process
+        pool so that the scheduler is not held up.
 
-        :param nbr: Fibonacci number to compute
-        :return: desired Fibonacci number
+        :param nbr: argument to the computation
+        :return: the result
         """
-        result = reduce(mul, range(1, nbr + 1), 1)
-        debug(f'fib for {nbr} is {result}')
+        result = self.compute_memo.get((self.compute_kind, nbr))
+        if result is None:
+            if nbr >= self.compute_offload_at:
+                result = await get_shared_pool().run(
+                    compute, self.compute_kind, nbr)
+            else:
+                result = compute(self.compute_kind, nbr)
+            self.compute_memo.put((self.compute_kind, nbr), result)
+        debug('%s for %d is %d', self.compute_kind.value, nbr, result)
         return result
 
     async def fib_runner(self, nbr: int):
         """
-        Run recursive fib until final number derived as a means of spacing
-        out the submission of words and to chew up some CPU time.
+        Run fib until final number derived as a means of spacing out the
+        submission of words and to chew up some CPU time.
 
         :param nbr:
         :return:
         """
         print(f'fib_runner started with {nbr} x {self.factor}')
         adjusted_nbr = nbr * self.factor
-        fib_task = await spawn(self.fib, adjusted_nbr)
-        result = await fib_task.join()
+        result = await self.fib(adjusted_nbr)
         word_to_check = self.raw_word_list[nbr]
-        debug(f'word extracted: {word_to_check}')
-        cqp = CurioQueueProducerClass(curio_queue=self.all_word_queue)
-        await cqp.producer_start()
-        await cqp.send_message(word_to_check)
-        await cqp.producer_stop()
+        debug('word extracted: %s', word_to_check)
+        await self.word_producer.send_message(self.number_word(word_to_check))
         print(f'Fibrunner finished with {result}')
         return
 
     async def word_check(self):
         """
         Extract words from the all_word_queue and check the spelling.  If
-        passed by the spell checker, add to the good_word_queue, else print
-        to standard out.
+        passed by the spell checker, add to the good_word_queue, else write
+        to word_sink as rejected (and offer to the suggestion stage, if
+        there is one).
+
+        Words are drained from the queue in chunks of up to
+        check_chunk_size and checked as a batch.  Several of these may run
+        at once; each one stops once the queue is closed and drained.
 
         :return:
         """
         debug('Got to word_check')
         cqc = CurioQueueConsumerClass(curio_queue=self.all_word_queue)
         await cqc.consumer_start()
-        cqp = CurioQueueProducerClass(curio_queue=self.good_word_queue)
+        cqp = CurioQueueProducerClass(curio_queue=self.good_word_queue,
+                                      envelopes=self.track_latency)
         await cqp.producer_start()
-        async for word in self.all_word_queue:
-            debug(f'word_check received {word}')
-            if word == self.stop_word:
+        while True:
+            chunk = await cqc.get_many(self.check_chunk_size)
+            if not chunk:
                 break
-            if self.spell_checker.check_word(word):
-                await self.good_word_queue.put(word)
+            debug('word_check received %d words', len(chunk))
+            words = [word for seq, word in chunk]
+            results = await self.check_words(words)
+            rejected = [word for word, word_ok in zip(words, results)
+                        if not word_ok]
+            await self.word_sink.reject(rejected)
+            if self.suggester is not None and rejected:
+                await self.offer_suggestions(rejected)
+            if self.ordered_output:
+                async with self.reorder_lock:
+                    for (seq, word), word_ok in zip(chunk, results):
+                        ready = self.reorder_buffer.add(
+                            seq, word if word_ok else None)
+                        await cqp.send_many(ready)
             else:
-                print(f'{word} rejected by Hunspell')
+                await cqp.send_many(word for word, word_ok
+                                    in zip(words, results) if word_ok)
+            self.chunk_checked(chunk)
+            await cqc.message_done(len(chunk))
         await cqc.consumer_stop()
         await cqp.producer_stop()
         debug('word_check ending')
         return
 
+    async def offer_suggestions(self, rejected: List[str]):
+        """
+        Pass rejected words on to the suggestion stage without waiting.
+        Words whose suggestions are still cached have already been
+        reported and are skipped; words that do not fit in the queue are
+        counted and dropped.
+
+        :param rejected: words the spell checker rejected
+        :return:
+        """
+        for word in dict.fromkeys(rejected):
+            if word in self.suggester.cache:
+                continue
+            if self.suggest_word_queue.full():
+                self.suggestions_dropped += 1
+            else:
+                await self.suggest_word_queue.put(word)
+        return
+
+    async def suggest_words(self):
+        """
+        Look up corrections for the words in suggest_word_queue and write
+        them to word_sink, until the queue is closed and drained.
+
+        :return:
+        """
+        cqc = CurioQueueConsumerClass(curio_queue=self.suggest_word_queue)
+        await cqc.consumer_start()
+        while True:
+            chunk = await cqc.get_many(self.check_chunk_size)
+            if not chunk:
+                break
+            records = [(word, await self.suggester.suggest(word))
+                       for word in chunk]
+            await self.word_sink.suggestions(records)
+            await cqc.message_done(len(chunk))
+        await cqc.consumer_stop()
+        return
+
+    def number_word(self, word: str) -> tuple:
+        """
+        Attach the next sequence number to a word headed for word_check.
+
+        :param word: word to number
+        :return: (sequence number, word)
+        """
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq, word
+
+    def chunk_checked(self, chunk: list):
+        """
+        Note that word_check has finished with a chunk and passed its good
+        words on.
+
+        :param chunk: (sequence number, word) pairs just handled
+        :return:
+        """
+        self.words_checked += len(chunk)
+        return
+
+    async def check_words(self, chunk: list) -> list:
+        """
+        Check a chunk of words, inline or on the worker pool.
+
+        :param chunk: words to check
+        :return: list of results in the same order as the words given
+        """
+        if self.check_mode == CheckMode.INLINE:
+            return self.spell_checker.check_words(chunk)
+        return await self.spell_checker.check_words(chunk)
+
     async def run_curio(self):
         """
         Start running tasks asynchronously.
@@ -221,45 +839,197 @@ class PlayCurioClass:
         :return:
         """
         debug('run_curio processes beginning')
+        if self.corpus_source is None:
+            await self.run_pipeline(self.feed_fib_words)
+        else:
+            await self.run_pipeline(self.feed_corpus_source)
+            print(f'\n{self.good_word_count} good words found in '
+                  f'{self.corpus_source.words_read} words read from '
+                  f'{self.corpus_source.path}')
+        self.report_cache_stats()
+        self.report_queue_stats()
+        if self.track_latency:
+            self.report_latency_stats()
+        if self.suggester is not None:
+            self.report_suggest_stats()
+        self.report_dispatch_stats()
+        debug('run_curio processes ending')
+        return
+
+    async def run_pipeline(self, feed) -> int:
+        """
+        Run the word_check tasks over whatever words feed sends through
+        word_producer, until feed returns and every word has been checked
+        and written to word_sink.
 
-        # start spell checker task
-        async with TaskGroup() as check_task:
-            debug('Starting TaskGroup check_task')
-            await check_task.spawn(self.word_check())
-            async with TaskGroup() as word_tasks:
-                debug('Starting TaskGroup word_tasks')
-                for task_nbr in range(10, 0, -1):
-                    debug(f'dispatching word_task: {task_nbr}')
-                    await word_tasks.spawn(self.fib_runner(task_nbr))
-                await word_tasks.join()
-                # await sleep(1)
-                debug('All tasks in word_tasks finished')
-                cqp = CurioQueueProducerClass(curio_queue=self.all_word_queue)
-                await cqp.producer_start()
-                await cqp.send_message(self.stop_word)
-                await cqp.producer_stop()
-                # await self.all_word_queue.put(self.stop_word)
-            await sleep(1)
-            await check_task.join()
-            cqp = CurioQueueProducerClass(curio_queue=self.good_word_queue)
-            await cqp.producer_start()
-            await cqp.send_message(self.stop_word)
-            await cqp.producer_stop()
-            # await self.good_word_queue.put(self.stop_word)
-            debug('All tasks in check_task finished')
-
-        # print out the good words
-        print(f'\nGood words found:')
+        :param feed: coroutine function that sends numbered words with
+            self.word_producer
+        :return: the number of good words found
+        """
+        # start spell checker tasks
+        self.word_producer = CurioQueueProducerClass(
+            curio_queue=self.all_word_queue, envelopes=self.track_latency)
+        await self.word_producer.producer_start()
+        # keep good_word_queue drained so a bounded queue cannot fill up
+        collect_task = await spawn(self.collect_good_words)
+        async with TaskGroup() as suggest_task:
+            if self.suggester is not None:
+                for _ in range(self.suggester.workers):
+                    await suggest_task.spawn(self.suggest_words)
+            async with TaskGroup() as check_task:
+                debug('Starting TaskGroup check_task')
+                for _ in range(self.check_consumers):
+                    await check_task.spawn(self.word_check())
+                await feed()
+                await self.word_producer.producer_close()
+                await check_task.join()
+                # word_check tasks in other processes may still be busy
+                await self.word_producer.producer_join()
+                cqp = CurioQueueProducerClass(
+                    curio_queue=self.good_word_queue)
+                await cqp.producer_close()
+                debug('All tasks in check_task finished')
+            good_word_count = await collect_task.join()
+            # suggestions trail the checks; let them catch up before the
+            # sink is closed
+            await self.suggest_word_queue.close()
+            await suggest_task.join()
+            if self.suggester is not None:
+                await self.suggester.finish()
+        await self.word_sink.close()
+        if self.broker_client is not None:
+            await self.broker_client.close()
+        return good_word_count
+
+    async def feed_fib_words(self):
+        """
+        Send the demo words, each once its fib_runner has done its sum.
+
+        :return:
+        """
+        async with TaskGroup() as word_tasks:
+            debug('Starting TaskGroup word_tasks')
+            for task_nbr in range(10, 0, -1):
+                debug('dispatching word_task: %d', task_nbr)
+                await word_tasks.spawn(self.fib_runner(task_nbr))
+            await word_tasks.join()
+            debug('All tasks in word_tasks finished')
+        return
+
+    async def feed_corpus_source(self):
+        """
+        Stream the words from corpus_source.
+
+        :return:
+        """
+        await self.corpus_source.send_words(self.word_producer,
+                                            self.number_word)
+        return
+
+    async def collect_good_words(self) -> int:
+        """
+        Pass the words from good_word_queue on to word_sink until the queue
+        is closed.
+
+        :return: the number of good words
+        """
         cqc = CurioQueueConsumerClass(curio_queue=self.good_word_queue)
         await cqc.consumer_start()
         while True:
-            word = await cqc.get_message()
-            # async for word in self.good_word_queue:
-            if word == self.stop_word:
+            good_words = await cqc.get_many(self.check_chunk_size)
+            if not good_words:
                 break
-            print(f'\t{word}')
+            await self.word_sink.accept(good_words)
+            self.good_word_count += len(good_words)
+            await cqc.message_done(len(good_words))
         await cqc.consumer_stop()
-        debug('run_curio processes ending')
+        return self.good_word_count
+
+    def report_cache_stats(self):
+        """
+        Print the spell checker cache counters for this run and how often
+        a dictionary has been loaded so far.
+
+        :return:
+        """
+        stats = self.spell_checker.cache_stats()
+        print(f'\nSpell check cache: {stats["hits"]} hits, '
+              f'{stats["misses"]} misses, {stats["evictions"]} evictions '
+              f'({stats["hit_ratio"]:.1%} hit ratio)')
+        # a process pool that was never sent a batch has no such counters
+        if stats.get('snapshot_hits', 0):
+            print(f'Word snapshot: {stats["snapshot_hits"]} found, '
+                  f'{stats["hunspell_lookups"]} passed on to Hunspell')
+        registry = get_registry().stats()
+        print(f'Dictionaries: {registry["loads"]} loaded in this process '
+              f'({registry["load_time"]:.3f}s), {registry["handles"]} '
+              f'handles shared')
+        return
+
+    def report_queue_stats(self):
+        """
+        Print the depth and backpressure counters of both queues.
+
+        :return:
+        """
+        for name, curio_queue in (('all_word_queue', self.all_word_queue),
+                                  ('good_word_queue', self.good_word_queue)):
+            stats = queue_stats(curio_queue)
+            print(f'{name}: depth {stats["depth"]}, '
+                  f'high watermark {stats["high_watermark"]} of '
+                  f'{stats["maxsize"] or "unlimited"}, '
+                  f'{stats["put_blocked_count"]} of {stats["put_count"]} '
+                  f'puts blocked for {stats["put_blocked_time"]:.3f}s')
+        return
+
+    def report_suggest_stats(self):
+        """
+        Print how the suggestion lookups went.
+
+        :return:
+        """
+        stats = self.suggester.suggest_stats()
+        print(f'Suggestions: {stats["looked_up"]} looked up in '
+              f'{stats["lookup_time"]:.3f}s, {stats["timed_out"]} over the '
+              f'{self.suggester.budget:.3f}s budget, {stats["hits"]} cached, '
+              f'{self.suggestions_dropped} words dropped with the queue full')
+        return
+
+    def report_latency_stats(self):
+        """
+        Print the queue wait and service time histograms of both queues.
+
+        :return:
+        """
+        for name, curio_queue in (('all_word_queue', self.all_word_queue),
+                                  ('good_word_queue', self.good_word_queue)):
+            for stage, histogram in (
+                    ('queue wait', curio_queue.wait_histogram),
+                    ('service', curio_queue.service_histogram)):
+                summary = histogram.summary()
+                print(f'{name} {stage}: {summary["count"]} messages, '
+                      f'mean {summary["mean"] * 1000:.3f}ms, '
+                      f'p50 {summary["p50"] * 1000:.3f}ms, '
+                      f'p99 {summary["p99"] * 1000:.3f}ms, '
+                      f'max {summary["max"] * 1000:.3f}ms')
+                for upper_bound, bucket_count in histogram.buckets():
+                    print(f'\t<= {upper_bound * 1000:10.3f}ms '
+                          f'{bucket_count}')
+        return
+
+    @staticmethod
+    def report_dispatch_stats():
+        """
+        Print what the calls to the shared process pool have cost so far
+        beyond the work done in the workers.
+
+        :return:
+        """
+        stats = get_shared_pool().dispatch_stats()
+        print(f'Process pool: {stats["calls"]} calls, '
+              f'{stats["compute_time"]:.3f}s computing, '
+              f'{stats["overhead"]:.3f}s dispatch overhead '
+              f'({stats["mean_overhead"] * 1000:.2f}ms per call)')
         return
 
 
@@ -273,29 +1043,168 @@ class MainClass:
         Get things started.
         """
         self.play_curio = None
+        self.sched_trace = None
+        self.metrics_server = None
         return
 
-    def run_play_curio(self):
+    def run_play_curio(self, check_mode: CheckMode = CheckMode.INLINE,
+                       check_workers: int = 4, check_consumers: int = 1,
+                       ordered_output: bool = True, queue_size: int = 0,
+                       compute_kind: ComputeKind = ComputeKind.FACTORIAL,
+                       trace_mode: TraceMode = TraceMode.OFF,
+                       trace_sample_every: int = 1,
+                       trace_path: str = 'schedtrace.bin',
+                       metrics_port: Optional[int] = None,
+                       corpus_path: Optional[str] = None,
+                       sink_kind: Optional[SinkKind] = None,
+                       sink_path: Optional[str] = None,
+                       snapshot_path: Optional[str] = None,
+                       track_latency: bool = False,
+                       suggest_mode: Optional[CheckMode] = None,
+                       broker_address: Optional[Tuple[str, int]] = None,
+                       shards: int = 1):
         """
         Run the play async class for testing.
 
+        :param check_mode: where to run the spell checks
+        :param check_workers: size of the spell check worker pool
+        :param check_consumers: number of word_check tasks
+        :param ordered_output: keep the good words in input order
+        :param queue_size: capacity of the word queues (0 = no limit)
+        :param compute_kind: number worked out by fib
+        :param trace_mode: trace the scheduler into a ring buffer dumped to
+            trace_path when curio ends, through logging (schedtrace), or not
+            at all (the default)
+        :param trace_sample_every: with the ring buffer, trace only one
+            task in this many
+        :param trace_path: file the ring buffer is dumped to
+        :param metrics_port: local port serving /metrics and /metrics.json
+            while curio runs, e.g. METRICS_PORT (None for no metrics
+            server)
+        :param corpus_path: text file whose words are checked instead of
+            the demo words ('-' for standard input); the queues are then
+            bounded to CORPUS_QUEUE_SIZE unless queue_size says otherwise
+        :param sink_kind: where the checked words are written (default:
+            the console, or only counts for a corpus)
+        :param sink_path: output file for the sink
+        :param snapshot_path: precompiled word snapshot to check words
+            against before Hunspell
+        :param track_latency: measure queue wait and service times and
+            print their histograms at the end
+        :param suggest_mode: where to look up corrections for the rejected
+            words (None for no suggestions)
+        :param broker_address: (host, port) of the queue broker to pass
+            the words through (None for in-process queues)
+        :param shards: check a corpus on this many worker processes, each
+            with its own curio kernel, routing each word to one of them by
+            its hash (see ShardedRun.py)
         :return:
         """
         debug('run_play_curio started')
-        self.play_curio = PlayCurioClass()
+        if corpus_path is not None:
+            corpus_source = CorpusSourceClass(corpus_path)
+            queue_size = queue_size or CORPUS_QUEUE_SIZE
+        else:
+            corpus_source = None
+        if sink_kind is not None:
+            word_sink = make_sink(sink_kind, sink_path)
+        else:
+            word_sink = None
+        if shards > 1:
+            self.run_sharded(corpus_source, shards, check_mode=check_mode,
+                             check_workers=check_workers,
+                             check_consumers=check_consumers,
+                             queue_size=queue_size,
+                             snapshot_path=snapshot_path,
+                             word_sink=word_sink)
+            return
+        self.play_curio = PlayCurioClass(check_mode=check_mode,
+                                         check_workers=check_workers,
+                                         check_consumers=check_consumers,
+                                         ordered_output=ordered_output,
+                                         queue_size=queue_size,
+                                         compute_kind=compute_kind,
+                                         corpus_source=corpus_source,
+                                         word_sink=word_sink,
+                                         snapshot_path=snapshot_path,
+                                         track_latency=track_latency,
+                                         suggest_mode=suggest_mode,
+                                         broker_address=broker_address)
+        if trace_mode == TraceMode.RING:
+            self.sched_trace = RingTraceClass(sample_every=trace_sample_every,
+                                              dump_path=trace_path)
+            curio_debug = [self.sched_trace]
+        elif trace_mode == TraceMode.LOG:
+            curio_debug = schedtrace
+        else:
+            curio_debug = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServerClass(self.play_curio,
+                                                     port=metrics_port)
+            activations = [self.metrics_server]
+        else:
+            self.metrics_server = None
+            activations = []
         debug('Starting up curio')
-        run(self.play_curio.run_curio, with_monitor=True,
-            debug=schedtrace)
+        run(self.run_with_metrics, with_monitor=True, debug=curio_debug,
+            activations=activations)
         debug('curio finished')
         return
 
     @staticmethod
-    def start_logging(work_dir: str, debug_name: str):
+    def run_sharded(corpus_source: Optional[CorpusSourceClass], shards: int,
+                    word_sink: Optional[WordSinkClass] = None, **settings):
+        """
+        Check a corpus on several worker processes and print the merged
+        results.
+
+        :param corpus_source: the words to check
+        :param shards: number of worker processes
+        :param word_sink: counts sink the results are merged into
+        :param settings: spell check settings for each shard
+        :return:
+        """
+        # the sharding module builds on this one, so import it only here
+        from CurioQueuePkg.ShardedRun import ShardedRunClass
+        if corpus_source is None:
+            raise ValueError('A sharded run needs a corpus')
+        if word_sink is not None and not isinstance(word_sink,
+                                                    CountsSinkClass):
+            raise ValueError('A sharded run can only merge into a counts '
+                             'sink')
+        sharded_run = ShardedRunClass(corpus_source, shards=shards,
+                                      word_sink=word_sink, **settings)
+        merged = run(sharded_run.run_shards)
+        sharded_run.report(merged)
+        return
+
+    async def run_with_metrics(self):
+        """
+        Run the play async class with the metrics server answering
+        alongside it.
+
+        :return:
+        """
+        if self.metrics_server is None:
+            await self.play_curio.run_curio()
+            return
+        metrics_task = await spawn(self.metrics_server.serve, daemon=True)
+        try:
+            await self.play_curio.run_curio()
+        finally:
+            await metrics_task.cancel()
+        return
+
+    @staticmethod
+    def start_logging(work_dir: str, debug_name: str,
+                      async_logging: bool = True):
         """
         Establish the logging for all the other scripts.
 
         :param work_dir:
         :param debug_name:
+        :param async_logging: hand records to a background writer thread
+            rather than writing them from the event loop
         :return: (nothing)
         """
 
@@ -333,6 +1242,9 @@ class MainClass:
             print('Minimal logging established to '
                   '{}'.format(_debugConfig))
 
+        if async_logging:
+            start_async_logging()
+
         # start logging
         global log
         log = getLogger(__name__)
@@ -366,8 +1278,16 @@ if __name__ == "__main__":
     print('Starting curio queue test...')
     run(run_main.test_curio_queue)
     print('Curio queue test completed successfully')
-    run_main.run_play_curio()
-    debug('Do it again')
-    run_main.run_play_curio()
+    if len(sys.argv) > 1:
+        # e.g. python CurioQueue.py big.txt [text|ndjson|counts out_file]
+        # or - in place of big.txt to read standard input
+        run_main.run_play_curio(
+            corpus_path=sys.argv[1],
+            sink_kind=SinkKind(sys.argv[2]) if len(sys.argv) > 2 else None,
+            sink_path=sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        run_main.run_play_curio()
+        debug('Do it again')
+        run_main.run_play_curio()
 
 # EOF
@@ -0,0 +1,217 @@
+"""
+DictionaryRegistry.py - Load each Hunspell dictionary once per process.
+
+Building a Hunspell object parses the .aff and .dic files from disk, which
+costs far more time and memory than any run of the word pipeline that
+uses it.  The registry here loads a dictionary the first time it is asked
+for and hands every later caller, in any thread and any pipeline run, a
+read-only handle on the same loaded copy.  Process pool workers each have
+their own registry, so a worker loads a dictionary once for the life of
+the (warm) pool rather than once per run.
+
+Precompiled word snapshots (see WordSnapshot.py) are kept here too, so a
+snapshot file is only mapped once per process.
+
+Lookups on one loaded copy take turns, as Hunspell objects cannot be
+used by two threads at once and the binding has no way to share the
+parsed files between objects.  Work that must not wait on other lookups
+therefore asks for its own copy under a role of its own: suggestions use
+SUGGEST_ROLE, and each thread of a worker pool uses a worker_role, paying
+for one more load per worker and process in return for lookups that run
+side by side.
+"""
+
+from logging import debug
+from threading import Lock
+from time import perf_counter
+from typing import Optional, Tuple
+
+from hunspell import Hunspell
+
+from CurioQueuePkg.WordSnapshot import WordSnapshotClass
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+DEFAULT_LANG = 'en_US'
+
+# roles a dictionary is loaded for; each role gets its own copy
+CHECK_ROLE = 'check'
+SUGGEST_ROLE = 'suggest'
+
+_registry = None
+_registry_lock = Lock()
+
+
+class SharedDictionaryClass:
+    """
+    Read-only handle on a loaded dictionary.  Lookups through the handles
+    on one dictionary take turns, as Hunspell itself is not thread safe.
+    """
+
+    def __init__(self, lang: str, hunspell: Hunspell, lock: Lock):
+        """
+        Wrap a loaded dictionary.
+
+        :param lang: language the dictionary is for
+        :param hunspell: the loaded Hunspell object
+        :param lock: lock shared by every handle on this dictionary
+        """
+        self.lang = lang
+        self._hunspell = hunspell
+        self._lock = lock
+        return
+
+    def spell(self, word: str) -> bool:
+        """
+        Check the spelling of a word.
+
+        :param word: word to check
+        :return: true if spelled ok or false if not a valid word
+        """
+        with self._lock:
+            return self._hunspell.spell(word)
+
+    def suggest(self, word: str) -> Tuple[str, ...]:
+        """
+        Suggest corrections for a word.
+
+        :param word: misspelled word
+        :return: the suggestions, best first
+        """
+        with self._lock:
+            return tuple(self._hunspell.suggest(word))
+
+
+class DictionaryRegistryClass:
+    """
+    The dictionaries loaded so far in this process, keyed by language,
+    data directory and role.
+    """
+
+    def __init__(self):
+        """
+        Start with nothing loaded.
+        """
+        self.dictionaries = {}
+        self.snapshots = {}
+        # guards the tables and counters, never held while loading
+        self.lock = Lock()
+        # one per dictionary, held while that dictionary loads
+        self.load_locks = {}
+        self.loads = 0
+        self.load_time = 0.0
+        self.handles = 0
+        return
+
+    def get(self, lang: str = DEFAULT_LANG, data_dir: Optional[str] = None,
+            role: str = CHECK_ROLE) -> SharedDictionaryClass:
+        """
+        Return a handle on a dictionary, loading it if this is the first
+        time it has been asked for.
+
+        :param lang: language of the dictionary, e.g. 'en_US'
+        :param data_dir: directory holding the .aff and .dic files (None
+            for Hunspell's default)
+        :param role: what the dictionary is used for (CHECK_ROLE,
+            SUGGEST_ROLE or a worker_role of either); each role has its
+            own loaded copy
+        :return: a read-only handle on the loaded dictionary
+        """
+        key = (lang, data_dir, role)
+        with self.lock:
+            loaded = self.dictionaries.get(key)
+            load_lock = self.load_locks.setdefault(key, Lock())
+        if loaded is None:
+            # only callers wanting this same copy wait while it loads
+            with load_lock:
+                with self.lock:
+                    loaded = self.dictionaries.get(key)
+                if loaded is None:
+                    started = perf_counter()
+                    if data_dir is None:
+                        hunspell = Hunspell(lang)
+                    else:
+                        hunspell = Hunspell(lang, hunspell_data_dir=data_dir)
+                    load_time = perf_counter() - started
+                    debug('Loaded Hunspell dictionary %s for %s in %.3fs',
+                          lang, role, load_time)
+                    loaded = (hunspell, Lock())
+                    with self.lock:
+                        self.dictionaries[key] = loaded
+                        self.loads += 1
+                        self.load_time += load_time
+        with self.lock:
+            self.handles += 1
+        hunspell, dictionary_lock = loaded
+        return SharedDictionaryClass(lang, hunspell, dictionary_lock)
+
+    def get_snapshot(self, snapshot_path: str) -> WordSnapshotClass:
+        """
+        Return the snapshot in a file, mapping it if this is the first
+        time it has been asked for.
+
+        :param snapshot_path: file written by build_snapshot
+        :return: the shared, read-only snapshot
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(snapshot_path)
+            if snapshot is None:
+                snapshot = WordSnapshotClass(snapshot_path)
+                self.snapshots[snapshot_path] = snapshot
+                debug('Mapped word snapshot %s (%d words)', snapshot_path,
+                      len(snapshot))
+        return snapshot
+
+    def stats(self) -> dict:
+        """
+        Report how often dictionaries were loaded and handed out.
+
+        :return: dictionary of counters and the seconds spent loading
+        """
+        stats = dict(dictionaries=len(self.dictionaries), loads=self.loads,
+                     load_time=self.load_time, handles=self.handles,
+                     snapshots=len(self.snapshots))
+        return stats
+
+
+def get_registry() -> DictionaryRegistryClass:
+    """
+    Return this process's dictionary registry, creating it on first use.
+
+    :return: the registry
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DictionaryRegistryClass()
+    return _registry
+
+
+def get_dictionary(lang: str = DEFAULT_LANG, data_dir: Optional[str] = None,
+                   role: str = CHECK_ROLE) -> SharedDictionaryClass:
+    """
+    Return a handle on a dictionary from this process's registry.
+
+    :param lang: language of the dictionary, e.g. 'en_US'
+    :param data_dir: directory holding the .aff and .dic files
+    :param role: CHECK_ROLE, SUGGEST_ROLE or a worker_role of either
+    :return: a read-only handle on the loaded dictionary
+    """
+    return get_registry().get(lang, data_dir, role)
+
+
+def worker_role(role: str, slot: int) -> str:
+    """
+    Role for the copy of a dictionary used by one worker of a pool, so
+    that the pool's workers do not take turns on a single copy.
+
+    :param role: CHECK_ROLE or SUGGEST_ROLE
+    :param slot: the worker's number within its pool
+    :return: the worker's role
+    """
+    return f'{role}:{slot}'
+
+# EOF
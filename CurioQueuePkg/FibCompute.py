@@ -0,0 +1,94 @@
+"""
+FibCompute.py - CPU bound number crunching used to pace the word pipeline
+and by the Fibonacci tutorial demos.
+
+The functions here are plain (not async) so that they can be run in a
+worker process as well as inline.
+"""
+
+from enum import Enum
+from functools import reduce
+from operator import mul
+from typing import Iterator, Tuple
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+
+class ComputeKind(Enum):
+    """
+    Which number the compute stage works out.
+    """
+    FACTORIAL = 'factorial'
+    FIBONACCI = 'fibonacci'
+
+
+def factorial(nbr: int) -> int:
+    """
+    Compute nbr! by multiplying out 1 * 2 * ... * nbr.
+
+    :param nbr: number to take the factorial of
+    :return: nbr!
+    """
+    return reduce(mul, range(1, nbr + 1), 1)
+
+
+def _fib_pair(nbr: int) -> Tuple[int, int]:
+    """
+    Compute (F(nbr), F(nbr + 1)) by fast doubling.
+
+    :param nbr: index of the first Fibonacci number wanted
+    :return: the pair of consecutive Fibonacci numbers
+    """
+    if nbr == 0:
+        return 0, 1
+    fib_k, fib_k1 = _fib_pair(nbr >> 1)
+    fib_2k = fib_k * (2 * fib_k1 - fib_k)
+    fib_2k1 = fib_k * fib_k + fib_k1 * fib_k1
+    if nbr & 1:
+        return fib_2k1, fib_2k + fib_2k1
+    return fib_2k, fib_2k1
+
+
+def fib(nbr: int) -> int:
+    """
+    Compute the nbr'th Fibonacci number (F(0) = 0, F(1) = 1) in
+    O(log nbr) steps using fast doubling.
+
+    :param nbr: Fibonacci number to compute
+    :return: desired Fibonacci number
+    """
+    if nbr < 0:
+        raise ValueError(f'Fibonacci number {nbr} is not defined')
+    return _fib_pair(nbr)[0]
+
+
+def fib_table(nbr: int) -> Iterator[int]:
+    """
+    Yield F(0), F(1), ... F(nbr) in turn, each from the two before it, so
+    the whole table costs one addition per entry.
+
+    :param nbr: last Fibonacci number wanted
+    :return: generator of the Fibonacci numbers up to and including nbr
+    """
+    fib_k, fib_k1 = 0, 1
+    for _ in range(nbr + 1):
+        yield fib_k
+        fib_k, fib_k1 = fib_k1, fib_k + fib_k1
+
+
+def compute(kind: ComputeKind, nbr: int) -> int:
+    """
+    Work out the requested kind of number.
+
+    :param kind: ComputeKind.FACTORIAL or ComputeKind.FIBONACCI
+    :param nbr: argument to the computation
+    :return: the result
+    """
+    if kind == ComputeKind.FIBONACCI:
+        return fib(nbr)
+    return factorial(nbr)
+
+# EOF
@@ -2,9 +2,22 @@
 SpellChecker.py - Check the spplling of a word using the HunSpellChecker.
 """
 
+import os
+from functools import partial
+from time import monotonic
+from enum import Enum
 from logging import getLogger, debug, error
+from typing import Iterable, List, Optional, Tuple
+from uuid import uuid4
 
-from hunspell import Hunspell
+from curio import Lock, Queue, Semaphore, TaskTimeout, run_in_thread, spawn
+from curio import timeout_after
+
+from CurioQueuePkg.DictionaryRegistry import CHECK_ROLE, DEFAULT_LANG
+from CurioQueuePkg.DictionaryRegistry import SUGGEST_ROLE, get_dictionary
+from CurioQueuePkg.DictionaryRegistry import get_registry, worker_role
+from CurioQueuePkg.LruCache import LruCacheClass, combine_stats
+from CurioQueuePkg.WorkerPool import get_named_pool, get_shared_pool
 
 __author__ = 'Travis Risner'
 __project__ = "WordTrekSolver"
@@ -13,18 +26,62 @@ __creation_date__ = "{DATE}"
 
 log = getLogger(__name__)
 
+# checkers owned by this process when running as a process pool worker,
+# keyed by the word snapshot they use
+_process_checkers = {}
+
+# the run each of those checkers' counters were last reset for
+_process_runs = {}
+
+
+class CheckMode(Enum):
+    """
+    Where the spell checks are run.
+    """
+    INLINE = 'inline'
+    THREAD = 'thread'
+    PROCESS = 'process'
+
 
 class HunSpellCheckerClass:
     """
     Check the spelling of a word.
     """
 
-    def __init__(self):
+    def __init__(self, cache_size: int = 10000, lang: str = DEFAULT_LANG,
+                 snapshot_path: Optional[str] = None,
+                 snapshot_fallback: bool = True, role: str = CHECK_ROLE):
         """
         Set up for the checking the spelling of a word.
+
+        The dictionary itself is shared with every other checker for the
+        same language and role in this process and only loaded the first
+        time.
+        With a word snapshot the dictionary is not loaded until a word
+        turns up that the snapshot does not have.
+
+        :param cache_size: number of results to remember (0 disables)
+        :param lang: language of the Hunspell dictionary
+        :param snapshot_path: precompiled word snapshot answering exact
+            matches without Hunspell (see WordSnapshot.py)
+        :param snapshot_fallback: ask Hunspell about words missing from the
+            snapshot (False to reject them outright)
+        :param role: role the dictionary is loaded for; checkers that must
+            not take turns with each other need different roles
         """
         debug('Initializing Hunspell')
-        self.word_check = Hunspell()
+        self.lang = lang
+        self.role = role
+        self.word_check = None
+        if snapshot_path is None:
+            self.snapshot = None
+            self.word_check = get_dictionary(lang, None, role)
+        else:
+            self.snapshot = get_registry().get_snapshot(snapshot_path)
+        self.snapshot_fallback = snapshot_fallback
+        self.snapshot_hits = 0
+        self.hunspell_lookups = 0
+        self.cache = LruCacheClass(max_size=cache_size)
         # config_list = self.word_check.ConfigKeys()
         # # print(config_list:'encoding')
         # for config_item in config_list:
@@ -41,9 +98,383 @@ class HunSpellCheckerClass:
         :param test_word: word to check
         :return: true if spelled ok or false if not a valid word
         """
-        debug(f'check_word received {test_word}')
-        result = self.word_check.spell(test_word.lower())
-        debug(f'check_word result {result}')
+        debug('check_word received %s', test_word)
+        result = self._spell(test_word.lower())
+        debug('check_word result %s', result)
         return result
 
+    def _spell(self, word: str) -> bool:
+        """
+        Look up an already lowercased word, using the cache when possible.
+
+        :param word: word to check
+        :return: true if spelled ok or false if not a valid word
+        """
+        result = self.cache.get(word)
+        if result is None:
+            if self.snapshot is not None and word in self.snapshot:
+                self.snapshot_hits += 1
+                result = True
+            elif self.snapshot is None or self.snapshot_fallback:
+                if self.word_check is None:
+                    self.word_check = get_dictionary(self.lang, None,
+                                                     self.role)
+                self.hunspell_lookups += 1
+                result = self.word_check.spell(word)
+            else:
+                result = False
+            self.cache.put(word, result)
+        return result
+
+    def check_words(self, test_words: Iterable[str]) -> List[bool]:
+        """
+        Check a batch of words to see if they are spelled correctly.
+
+        Each word is lowercased and only looked up once per batch, no
+        matter how often it appears.  A single summary record is logged
+        for the whole batch rather than two per word.
+
+        :param test_words: words to check
+        :return: list of results in the same order as the words given
+        """
+        lowered = [word.lower() for word in test_words]
+        verdicts = {word: self._spell(word) for word in set(lowered)}
+        results = [verdicts[word] for word in lowered]
+        debug('check_words checked %d words (%d unique), %d rejected',
+              len(lowered), len(verdicts), results.count(False))
+        return results
+
+    def cache_stats(self) -> dict:
+        """
+        Report how well the result cache is doing, and how the words it
+        did not have were answered.
+
+        :return: dictionary of cache and lookup counters
+        """
+        stats = self.cache.stats()
+        stats.update(snapshot_hits=self.snapshot_hits,
+                     hunspell_lookups=self.hunspell_lookups)
+        return stats
+
+    def reset_stats(self):
+        """
+        Count cache and lookup results from zero again, keeping what is
+        cached.
+
+        :return:
+        """
+        self.cache.reset_stats()
+        self.snapshot_hits = 0
+        self.hunspell_lookups = 0
+        return
+
+
+def _check_words_in_process(test_words: List[str], cache_size: int,
+                            snapshot_path: Optional[str] = None,
+                            run_token: Optional[str] = None
+                            ) -> Tuple[List[bool], int, dict]:
+    """
+    Check a batch of words inside a process pool worker.
+
+    The worker builds its own Hunspell checker the first time it is used
+    and keeps it, cache and all, for every later batch sent to the same
+    process.  Its counters start again from zero with each new run, so
+    they only ever cover the run they are reported to.
+
+    :param test_words: words to check
+    :param cache_size: cache size for the checker of this process
+    :param snapshot_path: word snapshot for the checker, if any
+    :param run_token: identifies the run the batch belongs to
+    :return: results, the worker pid and its counters for this run
+    """
+    checker = _process_checkers.get(snapshot_path)
+    if checker is None:
+        checker = HunSpellCheckerClass(cache_size=cache_size,
+                                       snapshot_path=snapshot_path)
+        _process_checkers[snapshot_path] = checker
+    if _process_runs.get(snapshot_path) != run_token:
+        checker.reset_stats()
+        _process_runs[snapshot_path] = run_token
+    results = checker.check_words(test_words)
+    return results, os.getpid(), checker.cache_stats()
+
+
+class HunSpellWorkerPoolClass:
+    """
+    Run spell checks on a pool of workers so that the blocking Hunspell
+    lookups do not stall the curio scheduler.
+
+    In thread mode each worker thread borrows one of the pool's own
+    checkers for the length of a batch.  Each checker has its own cache and
+    its own copy of the dictionary, loaded once per process under the
+    worker's role, so the threads' lookups do not take turns.  In process
+    mode the batches go to the shared warm process pool, where each worker
+    process builds its own checker.
+    """
+
+    def __init__(self, mode: CheckMode = CheckMode.THREAD, workers: int = 4,
+                 cache_size: int = 10000, snapshot_path: Optional[str] = None):
+        """
+        Set up the pool.
+
+        :param mode: CheckMode.THREAD or CheckMode.PROCESS
+        :param workers: number of batches allowed to run at once
+        :param cache_size: cache size for each worker's checker
+        :param snapshot_path: word snapshot for the workers' checkers
+        """
+        if mode == CheckMode.INLINE:
+            raise ValueError('A worker pool needs thread or process mode.')
+        self.mode = mode
+        self.workers = workers
+        self.cache_size = cache_size
+        self.snapshot_path = snapshot_path
+        self.checkers = []
+        self.checkers_started = 0
+        self.idle_checkers = Queue()
+        self.worker_slots = Semaphore(workers)
+        self.process_stats = {}
+        # lets the warm worker processes tell this run's batches apart
+        self.run_token = uuid4().hex
+        return
+
+    async def check_words(self, test_words: List[str]) -> List[bool]:
+        """
+        Check a batch of words on one of the workers.
+
+        :param test_words: words to check
+        :return: list of results in the same order as the words given
+        """
+        if self.mode == CheckMode.PROCESS:
+            async with self.worker_slots:
+                results, pid, stats = await get_shared_pool().run(
+                    _check_words_in_process, test_words, self.cache_size,
+                    self.snapshot_path, self.run_token)
+            self.process_stats[pid] = stats
+        else:
+            checker = await self._acquire_checker()
+            try:
+                results = await run_in_thread(checker.check_words,
+                                              test_words)
+            finally:
+                await self.idle_checkers.put(checker)
+        return results
+
+    async def _acquire_checker(self) -> HunSpellCheckerClass:
+        """
+        Borrow an idle checker, building a new one if the pool is not full.
+
+        :return: a checker not in use by any other thread
+        """
+        if self.idle_checkers.empty() and self.checkers_started < self.workers:
+            self.checkers_started += 1
+            debug(f'Starting spell check worker {self.checkers_started}')
+            checker = await run_in_thread(partial(
+                HunSpellCheckerClass, self.cache_size, DEFAULT_LANG,
+                self.snapshot_path,
+                role=worker_role(CHECK_ROLE, self.checkers_started)))
+            self.checkers.append(checker)
+            return checker
+        return await self.idle_checkers.get()
+
+    def cache_stats(self) -> dict:
+        """
+        Report the combined cache counters of all the workers.
+
+        :return: dictionary of cache counters
+        """
+        if self.mode == CheckMode.PROCESS:
+            return combine_stats(self.process_stats.values())
+        return combine_stats(checker.cache_stats()
+                             for checker in self.checkers)
+
+
+def _suggest_in_process(word: str, lang: str) -> Tuple[str, ...]:
+    """
+    Suggest corrections for a word inside a process pool worker, using the
+    worker's own suggestion dictionary.
+
+    :param word: misspelled word
+    :param lang: language of the dictionary
+    :return: the suggestions, best first
+    """
+    return get_dictionary(lang, role=SUGGEST_ROLE).suggest(word)
+
+
+class HunSpellSuggesterClass:
+    """
+    Find corrections for misspelled words on a pool of workers.
+
+    Hunspell's suggest is far slower than spell, so each word gets a time
+    budget.  A word that runs over it is given up on and reported as having
+    no suggestions.  Its lookup still finishes in the background, and until
+    it does the worker it runs on is not free for later words, which wait
+    for another worker; that wait is not charged to their budget.  Answers
+    that did come back in time are cached.
+
+    In thread mode each lookup borrows one of the suggester's own copies of
+    the dictionary, one per worker, so the lookups neither hold up the
+    spell checks nor take turns with each other.  In process mode they run
+    on a warm process pool of their own, one process per worker, so they
+    never queue behind the spell checks or the compute stage in the shared
+    pool.
+    """
+
+    def __init__(self, mode: CheckMode = CheckMode.THREAD, workers: int = 2,
+                 budget: float = 0.5, cache_size: int = 10000,
+                 lang: str = DEFAULT_LANG):
+        """
+        Set up the suggester.  The dictionaries are loaded on first use.
+
+        :param mode: CheckMode.THREAD or CheckMode.PROCESS
+        :param workers: number of lookups allowed to run at once
+        :param budget: most seconds to wait for one word's suggestions
+        :param cache_size: number of words whose suggestions are kept
+        :param lang: language of the Hunspell dictionary
+        """
+        if mode == CheckMode.INLINE:
+            raise ValueError('Suggestions need thread or process mode.')
+        self.mode = mode
+        self.workers = workers
+        self.budget = budget
+        self.lang = lang
+        self.cache = LruCacheClass(max_size=cache_size)
+        self.worker_slots = Semaphore(workers)
+        if mode == CheckMode.PROCESS:
+            self.process_pool = get_named_pool(
+                SUGGEST_ROLE, workers, ('CurioQueuePkg.HunSpellChecker',))
+        else:
+            self.process_pool = None
+        self.pool_warm = False
+        self.warm_lock = Lock()
+        self.dictionaries_started = 0
+        self.idle_dictionaries = Queue()
+        # lookups given up on that may still be running
+        self.abandoned = set()
+        self.looked_up = 0
+        self.timed_out = 0
+        self.lookup_time = 0.0
+        return
+
+    async def suggest(self, word: str) -> Optional[Tuple[str, ...]]:
+        """
+        Suggest corrections for a word within the time budget.
+
+        :param word: misspelled word
+        :return: the suggestions, best first, or None if the budget ran
+            out first
+        """
+        suggestions = self.cache.get(word)
+        if suggestions is not None:
+            return suggestions
+        # starting the pool, waiting for a free worker or loading a
+        # dictionary is not charged to the word's budget
+        if self.mode == CheckMode.PROCESS:
+            async with self.warm_lock:
+                if not self.pool_warm:
+                    await self.process_pool.warm_up()
+                    self.pool_warm = True
+            await self.worker_slots.acquire()
+            lookup = await spawn(self._lookup_in_process, word, daemon=True)
+        else:
+            dictionary = await self._acquire_dictionary()
+            lookup = await spawn(self._lookup, dictionary, word,
+                                 daemon=True)
+        suggestions = await self._within_budget(word, lookup.join)
+        if suggestions is None:
+            self.abandoned = {task for task in self.abandoned
+                              if not task.terminated}
+            self.abandoned.add(lookup)
+            return None
+        self.cache.put(word, suggestions)
+        return suggestions
+
+    async def _within_budget(self, word: str, lookup,
+                             *args) -> Optional[Tuple[str, ...]]:
+        """
+        Wait for a word's suggestions for no longer than the budget.
+
+        :param word: misspelled word
+        :param lookup: coroutine function giving the suggestions
+        :param args: arguments for lookup
+        :return: the suggestions, or None if the budget ran out first
+        """
+        started = monotonic()
+        try:
+            suggestions = await timeout_after(self.budget, lookup, *args)
+        except TaskTimeout:
+            self.timed_out += 1
+            debug('Suggestions for %s took over %.3fs', word, self.budget)
+            return None
+        finally:
+            self.looked_up += 1
+            self.lookup_time += monotonic() - started
+        return tuple(suggestions)
+
+    async def _acquire_dictionary(self):
+        """
+        Borrow an idle dictionary, loading another if fewer than workers
+        have been loaded.
+
+        :return: a dictionary not in use by any other lookup
+        """
+        if (self.idle_dictionaries.empty() and
+                self.dictionaries_started < self.workers):
+            self.dictionaries_started += 1
+            return await run_in_thread(
+                get_dictionary, self.lang, None,
+                worker_role(SUGGEST_ROLE, self.dictionaries_started))
+        return await self.idle_dictionaries.get()
+
+    async def _lookup(self, dictionary, word: str) -> Tuple[str, ...]:
+        """
+        Look up a word on a worker thread, then hand the dictionary back,
+        even if the word's budget ran out long before.
+
+        :param dictionary: dictionary borrowed for this lookup
+        :param word: misspelled word
+        :return: the suggestions, best first
+        """
+        try:
+            return await run_in_thread(dictionary.suggest, word)
+        finally:
+            await self.idle_dictionaries.put(dictionary)
+
+    async def _lookup_in_process(self, word: str) -> Tuple[str, ...]:
+        """
+        Look up a word on the suggestion pool, then free its worker slot,
+        even if the word's budget ran out long before, so that no more
+        jobs are ever sent than the pool has processes.
+
+        :param word: misspelled word
+        :return: the suggestions, best first
+        """
+        try:
+            return await self.process_pool.run(_suggest_in_process, word,
+                                               self.lang)
+        finally:
+            await self.worker_slots.release()
+
+    async def finish(self):
+        """
+        Wait for the lookups that ran over their budget to end, so that
+        none is left running when the kernel stops.
+
+        :return:
+        """
+        for lookup in self.abandoned:
+            await lookup.wait()
+        self.abandoned = set()
+        return
+
+    def suggest_stats(self) -> dict:
+        """
+        Report the lookups made, the ones over budget and the cache.
+
+        :return: dictionary of counters and times in seconds
+        """
+        stats = self.cache.stats()
+        stats.update(looked_up=self.looked_up, timed_out=self.timed_out,
+                     lookup_time=self.lookup_time)
+        return stats
+
 # EOF
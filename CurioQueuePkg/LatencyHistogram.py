@@ -0,0 +1,151 @@
+"""
+LatencyHistogram.py - Compact log-bucketed latency histograms.
+
+Keeping every latency to work out percentiles costs memory in proportion
+to the number of messages.  LatencyHistogramClass instead counts values
+into buckets in the manner of HdrHistogram: values below 2 * sub_buckets
+ticks get a bucket each, and above that every power of two is split into
+sub_buckets equal buckets, so each bucket is within 1 / sub_buckets of the
+values in it however large they get.  Recording is a few integer
+operations and the whole histogram is a short list of counts.
+"""
+
+from typing import Dict, List
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+# percentiles reported by summary
+SUMMARY_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogramClass:
+    """
+    Log-bucketed histogram of durations in seconds.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 4, tick: float = 1e-6):
+        """
+        Set up an empty histogram.
+
+        :param sub_bucket_bits: log2 of the buckets per power of two
+            (4 gives 16 buckets, so values are within 1/16 of their bucket)
+        :param tick: resolution in seconds (default one microsecond)
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.tick = tick
+        self.counts = []
+        self.count = 0
+        self.total = 0.0
+        self.max_value = 0.0
+        return
+
+    def _index(self, ticks: int) -> int:
+        """
+        Bucket holding a value.
+
+        :param ticks: the value in ticks
+        :return: bucket index
+        """
+        if ticks < 2 * self.sub_buckets:
+            return ticks
+        shift = ticks.bit_length() - self.sub_bucket_bits - 1
+        return shift * self.sub_buckets + (ticks >> shift)
+
+    def _upper_bound(self, index: int) -> int:
+        """
+        Largest value, in ticks, that falls into a bucket.
+
+        :param index: bucket index
+        :return: the value
+        """
+        if index < 2 * self.sub_buckets:
+            return index
+        shift = index // self.sub_buckets - 1
+        mantissa = index - shift * self.sub_buckets
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        """
+        Count one duration.
+
+        :param seconds: the duration
+        :return:
+        """
+        ticks = int(seconds / self.tick) if seconds > 0 else 0
+        index = self._index(ticks)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max_value:
+            self.max_value = seconds
+        return
+
+    def merge(self, other: 'LatencyHistogramClass'):
+        """
+        Add the counts of another histogram with the same layout.
+
+        :param other: histogram to add in
+        :return:
+        """
+        if (other.sub_bucket_bits, other.tick) != (self.sub_bucket_bits,
+                                                   self.tick):
+            raise ValueError('Histograms with different buckets cannot be '
+                             'merged')
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for index, bucket_count in enumerate(other.counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.max_value = max(self.max_value, other.max_value)
+        return
+
+    def percentile(self, percent: float) -> float:
+        """
+        Value at or below which a given percentage of the durations fall,
+        to the resolution of the buckets.
+
+        :param percent: e.g. 99.0
+        :return: the duration in seconds (0.0 if nothing was recorded)
+        """
+        if not self.count:
+            return 0.0
+        wanted = max(int(round(percent / 100.0 * self.count)), 1)
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= wanted:
+                return min(self._upper_bound(index) * self.tick,
+                           self.max_value)
+        return self.max_value
+
+    def buckets(self) -> List[tuple]:
+        """
+        The buckets in use.
+
+        :return: list of (upper bound in seconds, count)
+        """
+        return [(self._upper_bound(index) * self.tick, bucket_count)
+                for index, bucket_count in enumerate(self.counts)
+                if bucket_count]
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Count, mean, maximum and the usual percentiles.
+
+        :return: dictionary of figures in seconds
+        """
+        summary = dict(count=self.count,
+                       mean=self.total / self.count if self.count else 0.0,
+                       max=self.max_value)
+        for percent in SUMMARY_PERCENTILES:
+            summary[f'p{percent:g}'] = self.percentile(percent)
+        return summary
+
+# EOF
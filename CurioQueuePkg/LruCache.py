@@ -0,0 +1,124 @@
+"""
+LruCache.py - A small bounded cache with least-recently-used eviction.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+_MISSING = object()
+
+
+class LruCacheClass:
+    """
+    Keep up to max_size results, discarding the least recently used
+    entry when full.  Hits, misses and evictions are counted so the
+    effectiveness of the cache can be reported.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        """
+        Set up an empty cache.
+
+        :param max_size: most entries to keep (0 disables caching)
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        Check for a key without counting a lookup or marking it used.
+
+        :param key: key to look for
+        :return: true if the key is cached
+        """
+        return key in self.entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Look up a key, marking it as most recently used.
+
+        :param key: key to look up
+        :param default: value returned (and counted as a miss) if absent
+        :return: the cached value or default
+        """
+        value = self.entries.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Add or replace an entry, evicting the oldest one if full.
+
+        :param key: key to store
+        :param value: value to store
+        :return:
+        """
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return
+
+    def reset_stats(self):
+        """
+        Count hits, misses and evictions from zero again, keeping the
+        entries.
+
+        :return:
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report the cache counters.
+
+        :return: dictionary of size, hits, misses, evictions and hit ratio
+        """
+        lookups = self.hits + self.misses
+        hit_ratio = self.hits / lookups if lookups else 0.0
+        stats = dict(size=len(self.entries), max_size=self.max_size,
+                     hits=self.hits, misses=self.misses,
+                     evictions=self.evictions, hit_ratio=hit_ratio)
+        return stats
+
+
+def combine_stats(stats_list: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Add up the counters from several caches (e.g. one per worker),
+    including any extra counters the caches' owners report with them.
+
+    :param stats_list: dictionaries as returned by LruCacheClass.stats
+    :return: a single dictionary of the same shape
+    """
+    combined = dict(size=0, max_size=0, hits=0, misses=0, evictions=0)
+    for stats in stats_list:
+        for key, value in stats.items():
+            if key != 'hit_ratio':
+                combined[key] = combined.get(key, 0) + value
+    lookups = combined['hits'] + combined['misses']
+    combined['hit_ratio'] = combined['hits'] / lookups if lookups else 0.0
+    return combined
+
+# EOF
@@ -0,0 +1,198 @@
+"""
+MetricsServer.py - Serve the word pipeline's metrics over HTTP.
+
+bin/monitor.sh starts curio's interactive monitor, which a metrics
+collector cannot scrape.  MetricsServerClass runs inside the same curio
+kernel as the pipeline and answers plain HTTP requests on a local port:
+
+    /metrics        Prometheus text format
+    /metrics.json   the same figures as JSON
+"""
+
+import json
+from collections import Counter
+from logging import error
+from time import monotonic
+
+import psutil
+from curio import tcp_server
+from curio.kernel import Activation
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+METRICS_PORT = 9123
+
+
+class MetricsServerClass(Activation):
+    """
+    Collect task, queue, latency, throughput and process figures for a
+    running PlayCurioClass and serve them on request.
+
+    Pass the server to curio.run as an activation so it is told of each
+    task the kernel creates and ends, then spawn serve() as a daemon task.
+    """
+
+    def __init__(self, play_curio, host: str = '127.0.0.1',
+                 port: int = METRICS_PORT):
+        """
+        Set up the server.
+
+        :param play_curio: the PlayCurioClass instance being measured
+        :param host: address to listen on
+        :param port: TCP port to listen on
+        """
+        self.play_curio = play_curio
+        self.host = host
+        self.port = port
+        self.tasks = set()
+        self.process = psutil.Process()
+        self.process.cpu_percent(None)
+        self.last_sample = (monotonic(), 0)
+        return
+
+    def created(self, task):
+        """
+        Start counting a task the kernel has created.
+        """
+        self.tasks.add(task)
+
+    def terminated(self, task):
+        """
+        Stop counting a task that has ended.
+        """
+        self.tasks.discard(task)
+
+    async def serve(self):
+        """
+        Answer metrics requests until cancelled.  If the port cannot be
+        listened on the pipeline runs on without metrics.
+
+        :return:
+        """
+        try:
+            await tcp_server(self.host, self.port, self.handle_client)
+        except OSError as exc:
+            error(f'No metrics served, cannot listen on '
+                  f'{self.host}:{self.port}: {exc}')
+        return
+
+    async def handle_client(self, client, addr):
+        """
+        Answer one HTTP request.
+
+        :param client: curio socket connected to the client
+        :param addr: client address
+        :return:
+        """
+        request = b''
+        while b'\r\n\r\n' not in request and len(request) < 8192:
+            data = await client.recv(1024)
+            if not data:
+                break
+            request += data
+        request_line = request.split(b'\r\n', 1)[0].decode('latin-1')
+        parts = request_line.split()
+        path = parts[1] if len(parts) > 1 else '/'
+        metrics = self.collect()
+        if path == '/metrics.json':
+            status = '200 OK'
+            content_type = 'application/json'
+            body = json.dumps(metrics, indent=2)
+        elif path in ('/', '/metrics'):
+            status = '200 OK'
+            content_type = 'text/plain; version=0.0.4'
+            body = self.prometheus_text(metrics)
+        else:
+            status = '404 Not Found'
+            content_type = 'text/plain'
+            body = 'Try /metrics or /metrics.json\n'
+        body = body.encode('utf-8')
+        header = (f'HTTP/1.0 {status}\r\n'
+                  f'Content-Type: {content_type}\r\n'
+                  f'Content-Length: {len(body)}\r\n'
+                  f'Connection: close\r\n\r\n').encode('latin-1')
+        await client.sendall(header + body)
+        return
+
+    def collect(self) -> dict:
+        """
+        Gather the current figures.
+
+        :return: dictionary of metrics
+        """
+        task_states = dict(Counter(task.state for task in self.tasks))
+        now = monotonic()
+        words_checked = self.play_curio.words_checked
+        last_time, last_words = self.last_sample
+        words_per_second = ((words_checked - last_words) /
+                            (now - last_time) if now > last_time else 0.0)
+        self.last_sample = (now, words_checked)
+        named_queues = (('all_word_queue', self.play_curio.all_word_queue),
+                        ('good_word_queue', self.play_curio.good_word_queue))
+        queues = {name: curio_queue.queue_stats()
+                  for name, curio_queue in named_queues}
+        latency = {name: curio_queue.latency_stats()
+                   for name, curio_queue in named_queues}
+        cpu_times = self.process.cpu_times()
+        metrics = dict(tasks=task_states, queues=queues, latency=latency,
+                       words_checked=words_checked,
+                       words_per_second=words_per_second,
+                       process=dict(pid=self.process.pid,
+                                    cpu_percent=self.process.cpu_percent(None),
+                                    cpu_user_seconds=cpu_times.user,
+                                    cpu_system_seconds=cpu_times.system,
+                                    rss_bytes=self.process.memory_info().rss))
+        return metrics
+
+    @staticmethod
+    def prometheus_text(metrics: dict) -> str:
+        """
+        Lay the metrics out in the Prometheus text exposition format.
+
+        :param metrics: as returned by collect
+        :return: the text
+        """
+        lines = ['# TYPE curio_tasks gauge']
+        for state, count in sorted(metrics['tasks'].items()):
+            lines.append(f'curio_tasks{{state="{state}"}} {count}')
+        for stat, kind in (('depth', 'gauge'), ('high_watermark', 'gauge'),
+                           ('put_count', 'counter'),
+                           ('put_blocked_count', 'counter'),
+                           ('put_blocked_time', 'counter')):
+            lines.append(f'# TYPE curio_queue_{stat} {kind}')
+            for name, stats in sorted(metrics['queues'].items()):
+                if stat in stats:
+                    lines.append(f'curio_queue_{stat}{{queue="{name}"}} '
+                                 f'{stats[stat]}')
+        lines.append('# TYPE curio_queue_latency_seconds summary')
+        for name, stages in sorted(metrics['latency'].items()):
+            for stage, summary in sorted(stages.items()):
+                labels = f'queue="{name}",stage="{stage}"'
+                for quantile in ('p50', 'p90', 'p99', 'p99.9'):
+                    lines.append(f'curio_queue_latency_seconds{{{labels},'
+                                 f'quantile="{float(quantile[1:]) / 100:g}"}} '
+                                 f'{summary[quantile]}')
+                lines.append(f'curio_queue_latency_seconds_count{{{labels}}} '
+                             f'{summary["count"]}')
+                lines.append(f'curio_queue_latency_seconds_sum{{{labels}}} '
+                             f'{summary["mean"] * summary["count"]}')
+        process = metrics['process']
+        lines += ['# TYPE words_checked_total counter',
+                  f'words_checked_total {metrics["words_checked"]}',
+                  '# TYPE words_checked_per_second gauge',
+                  f'words_checked_per_second {metrics["words_per_second"]}',
+                  '# TYPE process_cpu_percent gauge',
+                  f'process_cpu_percent {process["cpu_percent"]}',
+                  '# TYPE process_cpu_seconds_total counter',
+                  f'process_cpu_seconds_total{{mode="user"}} '
+                  f'{process["cpu_user_seconds"]}',
+                  f'process_cpu_seconds_total{{mode="system"}} '
+                  f'{process["cpu_system_seconds"]}',
+                  '# TYPE process_resident_memory_bytes gauge',
+                  f'process_resident_memory_bytes {process["rss_bytes"]}']
+        return '\n'.join(lines) + '\n'
+
+# EOF
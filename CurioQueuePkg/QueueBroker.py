@@ -0,0 +1,826 @@
+"""
+QueueBroker.py - Share the pipeline's queues between processes over TCP.
+
+CurioQueueProducerClass and CurioQueueConsumerClass only need a queue with
+put, get, task_done, join and close.  BrokerQueueClass provides those for
+a named queue held by a broker process, so producers and word_check
+consumers can run in different processes or on different hosts.
+
+Run a broker with::
+
+    python -m CurioQueuePkg.QueueBroker serve --port 9125
+
+Every process talks to a broker over a single connection
+(BrokerClientClass), however many queues, producers and consumers it has.
+Each frame on the connection is a 4 byte big endian length followed by a
+UTF-8 JSON request or reply, and carries a whole batch of messages:
+
+    open     create the queue if need be         answered at once
+    put      add a batch of messages             answered once queued
+    get      take up to max messages             answered when there are
+                                                 some, or the queue is
+                                                 closed and drained
+    done     acknowledge count messages          not answered; counted
+                                                 after the puts sent
+                                                 before it
+    close    close the queue                     answered
+    join     wait for every message to be done   answered when it is
+    stats    the broker's queue counters         answered at once
+
+Puts are pipelined: up to window put frames may be waiting for their
+replies, and messages put while the window is full are held and sent as
+one frame once a reply comes back, so the batches grow with the load.
+The broker handles the puts, closes and joins for a queue from one
+connection in the order they were sent; gets are answered as messages
+arrive.  A process sends its acknowledgements after the messages it put
+while dealing with the acknowledged ones, and the broker counts them
+only once those are queued, so a join on the first queue also covers
+the work passed on to the next.
+
+Messages must survive a trip through JSON (tuples arrive as lists).
+Message envelopes lose their timings on the way, so the queue wait and
+service histograms are only kept for in-process queues.
+"""
+
+import json
+import socket
+import struct
+import sys
+from argparse import ArgumentParser
+from collections import deque
+from itertools import count
+from logging import debug
+from time import monotonic
+from typing import List, Optional, Tuple
+
+from curio import Event, Lock, Queue, TaskGroup, run, spawn
+from curio import open_connection, tcp_server
+
+from CurioQueuePkg.CurioQueue import CurioMeteredQueueClass
+from CurioQueuePkg.CurioQueue import CurioQueueClosedError, CurioQueueStatus
+from CurioQueuePkg.CurioQueue import MessageEnvelopeClass, PlayCurioClass
+from CurioQueuePkg.HunSpellChecker import CheckMode
+from CurioQueuePkg.LatencyHistogram import LatencyHistogramClass
+from CurioQueuePkg.WordSink import CountsSinkClass
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+BROKER_PORT = 9125
+
+FRAME_HEADER = struct.Struct('>I')
+
+# largest frame either side accepts
+MAX_FRAME = 1 << 24
+
+# requests the broker handles in order, per queue and connection
+ORDERED_OPS = ('put', 'close', 'join')
+
+
+class BrokerError(RuntimeError):
+    """
+    Raised when the broker refuses a request or the connection to it is
+    lost.
+    """
+    pass
+
+
+def encode_frame(body: dict) -> bytes:
+    """
+    Lay out a request or reply as a frame.
+
+    :param body: the request or reply
+    :return: length prefix and JSON text
+    """
+    data = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+async def read_frame(stream) -> Optional[dict]:
+    """
+    Read the next frame.
+
+    :param stream: curio socket stream to read from
+    :return: the request or reply, or None once the other side has closed
+        the connection
+    """
+    try:
+        header = await stream.read_exactly(FRAME_HEADER.size)
+        size, = FRAME_HEADER.unpack(header)
+        if size > MAX_FRAME:
+            raise BrokerError(f'Frame of {size} bytes is too large')
+        data = await stream.read_exactly(size)
+    except EOFError:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+class QueueBrokerClass:
+    """
+    Hold named queues and serve them to any number of connections.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = BROKER_PORT):
+        """
+        Set up a broker with no queues.
+
+        :param host: address to listen on
+        :param port: TCP port to listen on
+        """
+        self.host = host
+        self.port = port
+        self.queues = {}
+        self.connections = 0
+        self.frames_received = 0
+        return
+
+    def open_queue(self, name: str, maxsize: int = 0):
+        """
+        Find a queue, creating it if it does not exist.  A queue left
+        closed and drained by an earlier run is replaced by a fresh one.
+
+        :param name: queue name
+        :param maxsize: capacity of a new queue (0 = no limit)
+        :return: the queue
+        """
+        broker_queue = self.queues.get(name)
+        if (broker_queue is None or
+                (broker_queue.status != CurioQueueStatus.QUEUE_OPEN and
+                 broker_queue.empty() and not broker_queue._task_count)):
+            broker_queue = CurioMeteredQueueClass(maxsize=maxsize)
+            self.queues[name] = broker_queue
+            debug('Broker opened queue %s (maxsize %d)', name, maxsize)
+        return broker_queue
+
+    async def serve(self):
+        """
+        Accept connections until cancelled.
+
+        :return:
+        """
+        debug('Queue broker listening on %s:%d', self.host, self.port)
+        await tcp_server(self.host, self.port, self.handle_client)
+        return
+
+    async def handle_client(self, client, addr):
+        """
+        Answer the requests from one connection until it is closed.
+
+        :param client: curio socket connected to the client
+        :param addr: client address
+        :return:
+        """
+        self.connections += 1
+        debug('Broker connection from %s', addr)
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream = client.as_stream()
+        send_lock = Lock()
+        lanes = {}
+
+        async def reply(body: dict):
+            async with send_lock:
+                await client.sendall(encode_frame(body))
+
+        async with TaskGroup() as requests:
+            while True:
+                request = await read_frame(stream)
+                if request is None:
+                    break
+                self.frames_received += 1
+                op = request['op']
+                if op == 'open':
+                    self.open_queue(request['queue'],
+                                    request.get('maxsize', 0))
+                    await reply(dict(id=request['id']))
+                elif op == 'done':
+                    # counted once every lane has got past the puts sent
+                    # before it
+                    request['lanes'] = len(lanes)
+                    if not lanes:
+                        await self.count_done(request)
+                    for lane in lanes.values():
+                        await lane.put(request)
+                elif op in ORDERED_OPS:
+                    lane = lanes.get(request['queue'])
+                    if lane is None:
+                        lane = lanes[request['queue']] = Queue()
+                        await requests.spawn(self.run_lane, lane, reply,
+                                             requests)
+                    await lane.put(request)
+                else:
+                    await requests.spawn(self.answer, request, reply)
+            await requests.cancel_remaining()
+        await client.close()
+        debug('Broker connection from %s closed', addr)
+        return
+
+    async def run_lane(self, lane: Queue, reply, requests: TaskGroup):
+        """
+        Carry out the puts, closes and joins for one queue from one
+        connection in the order they arrived.  Acknowledgements from the
+        same connection pass through every lane, so they are only
+        counted after the puts sent before them.
+
+        :param lane: the requests, in order
+        :param reply: coroutine function sending a reply
+        :param requests: task group the joins wait in
+        :return:
+        """
+        while True:
+            request = await lane.get()
+            broker_queue = self.queues[request['queue']]
+            if request['op'] == 'done':
+                request['lanes'] -= 1
+                if not request['lanes']:
+                    await self.count_done(request)
+            elif request['op'] == 'put':
+                try:
+                    for item in request['items']:
+                        await broker_queue.put(item)
+                except CurioQueueClosedError as xcp:
+                    await reply(dict(id=request['id'], error=str(xcp)))
+                else:
+                    await reply(dict(id=request['id']))
+            elif request['op'] == 'close':
+                await broker_queue.close()
+                await reply(dict(id=request['id']))
+            else:
+                # later requests need not wait for the join
+                await requests.spawn(self.answer, request, reply)
+        return
+
+    async def count_done(self, request: dict):
+        """
+        Acknowledge messages on a queue.
+
+        :param request: the done request
+        :return:
+        """
+        broker_queue = self.queues[request['queue']]
+        for _ in range(request['count']):
+            await broker_queue.task_done()
+        return
+
+    async def answer(self, request: dict, reply):
+        """
+        Carry out a get, join or stats request.
+
+        :param request: the request
+        :param reply: coroutine function sending the reply
+        :return:
+        """
+        broker_queue = self.queues[request['queue']]
+        if request['op'] == 'get':
+            items = []
+            try:
+                items.append(await broker_queue.get())
+                while (len(items) < request['max'] and
+                       not broker_queue.empty()):
+                    items.append(await broker_queue.get())
+            except CurioQueueClosedError:
+                pass
+            await reply(dict(id=request['id'], items=items,
+                             closed=not items))
+        elif request['op'] == 'join':
+            await broker_queue.join()
+            await reply(dict(id=request['id']))
+        elif request['op'] == 'stats':
+            await reply(dict(id=request['id'],
+                             stats=broker_queue.queue_stats()))
+        else:
+            await reply(dict(id=request['id'],
+                             error=f'Unknown request {request["op"]}'))
+        return
+
+
+class BrokerClientClass:
+    """
+    One connection to a broker, shared by every queue that uses it.
+
+    The connection is opened when first needed and belongs to the curio
+    kernel running at the time; call close before that kernel ends.
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = BROKER_PORT):
+        """
+        Set up the client without connecting yet.
+
+        :param host: broker host
+        :param port: broker port
+        """
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.reader_task = None
+        self.connect_lock = Lock()
+        self.send_lock = Lock()
+        self.request_ids = count()
+        self.pending = {}
+        self.queues = {}
+        self.frames_sent = 0
+        self.frames_received = 0
+        return
+
+    def queue(self, name: str, maxsize: int = 0, batch_size: int = 256,
+              window: int = 4) -> 'BrokerQueueClass':
+        """
+        Return the queue of this name on the broker, reusing the handle
+        if it has been asked for before.
+
+        :param name: queue name
+        :param maxsize: capacity, if the broker has to create the queue
+        :param batch_size: most messages sent or fetched in one frame
+        :param window: most put frames waiting for a reply at once
+        :return: the queue
+        """
+        broker_queue = self.queues.get(name)
+        if broker_queue is None:
+            broker_queue = BrokerQueueClass(self, name, maxsize=maxsize,
+                                            batch_size=batch_size,
+                                            window=window)
+            self.queues[name] = broker_queue
+        return broker_queue
+
+    async def connect(self):
+        """
+        Open the connection unless it is already open.
+
+        :return:
+        """
+        async with self.connect_lock:
+            if self.sock is None:
+                self.sock = await open_connection(self.host, self.port)
+                # frames are batched already; do not hold them back
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                     1)
+                self.reader_task = await spawn(self.read_replies,
+                                               daemon=True)
+                debug('Connected to queue broker %s:%d', self.host,
+                      self.port)
+        return
+
+    async def send(self, body: dict):
+        """
+        Send a request without waiting for its reply.
+
+        :param body: the request
+        :return:
+        """
+        await self.connect()
+        async with self.send_lock:
+            await self.sock.sendall(encode_frame(body))
+        self.frames_sent += 1
+        return
+
+    def expect_reply(self, handler=None) -> Tuple[int, Optional[Event]]:
+        """
+        Set aside a request id and say what to do with its reply.
+
+        :param handler: coroutine function the reply is passed to, or None
+            to have request wait for it
+        :return: the request id and the event set when the reply arrives
+            (None if there is a handler)
+        """
+        request_id = next(self.request_ids)
+        if handler is None:
+            event = Event()
+            self.pending[request_id] = [event, None]
+        else:
+            event = None
+            self.pending[request_id] = handler
+        return request_id, event
+
+    async def request(self, body: dict) -> dict:
+        """
+        Send a request and wait for its reply.
+
+        :param body: the request, without an id
+        :return: the reply
+        """
+        request_id, event = self.expect_reply()
+        await self.send(dict(body, id=request_id))
+        await event.wait()
+        reply = self.pending.pop(request_id)[1]
+        if 'error' in reply:
+            raise BrokerError(reply['error'])
+        return reply
+
+    async def read_replies(self):
+        """
+        Pass each reply to whoever is waiting for it, until the
+        connection closes.
+
+        :return:
+        """
+        stream = self.sock.as_stream()
+        while True:
+            reply = await read_frame(stream)
+            if reply is None:
+                break
+            self.frames_received += 1
+            await self.deliver(reply)
+        debug('Queue broker %s:%d closed the connection', self.host,
+              self.port)
+        for request_id in list(self.pending):
+            await self.deliver(dict(id=request_id,
+                                    error='Connection to broker lost'))
+        return
+
+    async def deliver(self, reply: dict):
+        """
+        Hand one reply over.
+
+        :param reply: the reply
+        :return:
+        """
+        waiting = self.pending.get(reply['id'])
+        if isinstance(waiting, list):
+            waiting[1] = reply
+            await waiting[0].set()
+        elif waiting is not None:
+            del self.pending[reply['id']]
+            await waiting(reply)
+        return
+
+    async def flush(self):
+        """
+        Send every message held back by the queues on this connection.
+
+        :return:
+        """
+        for broker_queue in list(self.queues.values()):
+            await broker_queue.flush()
+        return
+
+    async def close(self):
+        """
+        Send what is still held back and close the connection.
+
+        :return:
+        """
+        if self.sock is None:
+            return
+        for broker_queue in list(self.queues.values()):
+            await broker_queue.flush()
+            await broker_queue.send_done()
+        for broker_queue in list(self.queues.values()):
+            await broker_queue.wait_acked()
+        await self.reader_task.cancel()
+        await self.sock.close()
+        self.sock = None
+        self.reader_task = None
+        return
+
+
+class BrokerQueueClass:
+    """
+    A queue held by a broker, usable wherever the producer and consumer
+    classes take a curio queue.
+
+    Messages are sent in batches of up to batch_size, at most window
+    batches ahead of the broker's replies, and fetched batch_size at a
+    time.  Acknowledgements are counted and sent with the next fetch,
+    after whatever this process has put in the meantime; the broker only
+    counts them once it has queued those messages, so join returns after
+    the work the messages led to has been passed on too.
+    """
+
+    def __init__(self, client: BrokerClientClass, name: str,
+                 maxsize: int = 0, batch_size: int = 256, window: int = 4):
+        """
+        Set up the handle.  Use BrokerClientClass.queue rather than
+        creating one directly.
+
+        :param client: connection to the broker
+        :param name: queue name
+        :param maxsize: capacity, if the broker has to create the queue
+        :param batch_size: most messages sent or fetched in one frame
+        :param window: most put frames waiting for a reply at once
+        """
+        self.client = client
+        self.name = name
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.window = window
+        self.status = CurioQueueStatus.QUEUE_OPEN
+        self.opened = False
+        self.outgoing = []
+        self.unacked = 0
+        self.acked = Event()
+        self.put_error = None
+        self.received = deque()
+        self.drained = False
+        self.fetch_lock = Lock()
+        self.done_count = 0
+        self.put_count = 0
+        self.put_blocked_count = 0
+        self.put_blocked_time = 0.0
+        self.high_watermark = 0
+        self.put_frames = 0
+        self.get_frames = 0
+        self.wait_histogram = LatencyHistogramClass()
+        self.service_histogram = LatencyHistogramClass()
+        return
+
+    async def _open(self):
+        """
+        Have the broker create the queue, the first time it is used.
+
+        :return:
+        """
+        if not self.opened:
+            await self.client.request(dict(op='open', queue=self.name,
+                                           maxsize=self.maxsize))
+            self.opened = True
+        return
+
+    def qsize(self) -> int:
+        """
+        Messages fetched from the broker and not yet taken.
+
+        :return: the count
+        """
+        return len(self.received)
+
+    def empty(self) -> bool:
+        """
+        Whether get would have to ask the broker for more.
+
+        :return: true if nothing fetched is left
+        """
+        return not self.received
+
+    def full(self) -> bool:
+        """
+        Whether put would wait.  Only the broker knows, so never.
+
+        :return: false
+        """
+        return False
+
+    async def put(self, item):
+        """
+        Add a message.  It is sent at once if there is room in the
+        window, otherwise held for the next batch; put only waits once
+        a whole batch is held.
+
+        :param item: message to add
+        :return:
+        """
+        if self.put_error is not None:
+            raise self.put_error
+        if self.status != CurioQueueStatus.QUEUE_OPEN:
+            raise CurioQueueClosedError('Queue is closed')
+        if isinstance(item, MessageEnvelopeClass):
+            item = item.payload
+        self.outgoing.append(item)
+        self.put_count += 1
+        self.high_watermark = max(self.high_watermark, len(self.outgoing))
+        if self.unacked >= self.window and len(self.outgoing) >= \
+                self.batch_size:
+            started = monotonic()
+            while self.unacked >= self.window:
+                self.acked.clear()
+                await self.acked.wait()
+            self.put_blocked_count += 1
+            self.put_blocked_time += monotonic() - started
+        if self.unacked < self.window:
+            await self._send_batch()
+        return
+
+    async def _send_batch(self):
+        """
+        Send up to batch_size of the messages held back.
+
+        :return:
+        """
+        if not self.outgoing:
+            return
+        await self._open()
+        items = self.outgoing[:self.batch_size]
+        del self.outgoing[:self.batch_size]
+        self.unacked += 1
+        request_id, _ = self.client.expect_reply(self._put_done)
+        await self.client.send(dict(id=request_id, op='put', queue=self.name,
+                                    items=items))
+        self.put_frames += 1
+        return
+
+    async def _put_done(self, reply: dict):
+        """
+        Note the broker's reply to a put and send on anything held back
+        meanwhile.  Runs in the client's reply reader.
+
+        :param reply: the reply
+        :return:
+        """
+        if 'error' in reply:
+            self.put_error = CurioQueueClosedError(reply['error'])
+        self.unacked -= 1
+        await self.acked.set()
+        if self.unacked < self.window:
+            await self._send_batch()
+        return
+
+    async def flush(self):
+        """
+        Send every message held back, whatever the window.
+
+        :return:
+        """
+        while self.outgoing:
+            await self._send_batch()
+        return
+
+    async def wait_acked(self):
+        """
+        Wait until the broker has queued every message sent so far.
+
+        :return:
+        """
+        while self.unacked:
+            self.acked.clear()
+            await self.acked.wait()
+        if self.put_error is not None:
+            raise self.put_error
+        return
+
+    async def get(self):
+        """
+        Take the next message, fetching a batch from the broker if none
+        are left.
+
+        :return: the message
+        """
+        while not self.received:
+            if self.drained:
+                raise CurioQueueClosedError('Queue is closed and empty')
+            async with self.fetch_lock:
+                if not self.received and not self.drained:
+                    await self._fetch()
+        return self.received.popleft()
+
+    async def _fetch(self):
+        """
+        Acknowledge what has been done and ask the broker for more.
+
+        :return:
+        """
+        await self._open()
+        await self.send_done()
+        reply = await self.client.request(dict(op='get', queue=self.name,
+                                               max=self.batch_size))
+        self.get_frames += 1
+        self.received.extend(reply['items'])
+        if reply['closed']:
+            self.drained = True
+        return
+
+    async def task_done(self):
+        """
+        Count a message as dealt with.  The count is sent later.
+
+        :return:
+        """
+        self.done_count += 1
+        return
+
+    async def send_done(self):
+        """
+        Send the messages this process has held back on any queue, then
+        the acknowledgements counted so far.
+
+        :return:
+        """
+        if self.done_count:
+            await self.client.flush()
+            done_count, self.done_count = self.done_count, 0
+            await self.client.send(dict(op='done', queue=self.name,
+                                        count=done_count))
+        return
+
+    async def close(self):
+        """
+        Send what is held back, then close the queue on the broker.
+
+        :return:
+        """
+        await self._open()
+        await self.flush()
+        await self.send_done()
+        await self.client.request(dict(op='close', queue=self.name))
+        self.status = CurioQueueStatus.QUEUE_CLOSED
+        return
+
+    async def join(self):
+        """
+        Wait until every message put on the queue, by any process, has
+        been acknowledged.
+
+        :return:
+        """
+        await self._open()
+        await self.client.flush()
+        await self.send_done()
+        await self.client.request(dict(op='join', queue=self.name))
+        return
+
+    async def broker_stats(self) -> dict:
+        """
+        Ask the broker for its counters for this queue.
+
+        :return: dictionary of queue counters
+        """
+        await self._open()
+        reply = await self.client.request(dict(op='stats', queue=self.name))
+        return reply['stats']
+
+    def queue_stats(self) -> dict:
+        """
+        Report this process's side of the queue.  The depth is the
+        messages fetched but not yet taken, the high watermark the most
+        messages held back waiting to be sent, and a put counts as
+        blocked when it had to wait for room in the window.
+
+        :return: dictionary of queue and frame counters
+        """
+        stats = dict(status=self.status.value, depth=len(self.received),
+                     maxsize=self.maxsize, high_watermark=self.high_watermark,
+                     put_count=self.put_count,
+                     put_blocked_count=self.put_blocked_count,
+                     put_blocked_time=self.put_blocked_time,
+                     put_frames=self.put_frames, get_frames=self.get_frames)
+        return stats
+
+    def latency_stats(self) -> dict:
+        """
+        Summarise the queue wait and service time histograms, which stay
+        empty as envelopes lose their timings on the way to the broker.
+
+        :return: dictionary of histogram summaries in seconds
+        """
+        stats = dict(queue_wait=self.wait_histogram.summary(),
+                     service=self.service_histogram.summary())
+        return stats
+
+
+async def run_checkers(play_curio: PlayCurioClass):
+    """
+    Check words from a broker's all_word_queue until it is closed and
+    drained, passing the good ones to its good_word_queue.
+
+    :param play_curio: pipeline set up with a broker_address
+    :return:
+    """
+    async with TaskGroup() as check_task:
+        for _ in range(play_curio.check_consumers):
+            await check_task.spawn(play_curio.word_check)
+    await play_curio.word_sink.close()
+    await play_curio.broker_client.close()
+    print(f'{play_curio.words_checked} words checked')
+    return
+
+
+def main(argv: List[str]) -> int:
+    """
+    Run a broker, or word_check tasks taking their words from one.
+
+    :param argv: command line arguments
+    :return: exit status
+    """
+    parser = ArgumentParser(description='Queue broker for the word '
+                                        'pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='run a broker')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=BROKER_PORT)
+    check_parser = commands.add_parser(
+        'check', help='check words from a broker until its queue closes')
+    check_parser.add_argument('--host', default='localhost')
+    check_parser.add_argument('--port', type=int, default=BROKER_PORT)
+    check_parser.add_argument('--check-mode', default=CheckMode.INLINE.value,
+                              choices=[mode.value for mode in CheckMode])
+    check_parser.add_argument('--check-workers', type=int, default=4)
+    check_parser.add_argument('--check-consumers', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        run(QueueBrokerClass(args.host, args.port).serve)
+        return 0
+    # results cannot be put back in order across processes
+    play_curio = PlayCurioClass(check_mode=CheckMode(args.check_mode),
+                                check_workers=args.check_workers,
+                                check_consumers=args.check_consumers,
+                                ordered_output=False,
+                                word_sink=CountsSinkClass(),
+                                broker_address=(args.host, args.port))
+    run(run_checkers, play_curio)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+
+# EOF
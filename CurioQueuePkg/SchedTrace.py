@@ -0,0 +1,258 @@
+"""
+SchedTrace.py - Low overhead scheduler tracing for curio kernels.
+
+curio.debug.schedtrace sends every task switch through the logging module,
+which under load costs more than the work being traced.  RingTraceClass
+instead packs each event into a fixed size binary record in a preallocated
+ring buffer, optionally only for a sample of the tasks, and writes the
+buffer out when asked.  Run this module on a dump to get per-task run and
+wait timelines::
+
+    python -m CurioQueuePkg.SchedTrace schedtrace.bin [--detail]
+
+curio has no hook for the moment a task is woken, so a wait is taken to
+last from the task suspending until it next runs.
+"""
+
+import json
+import struct
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from enum import Enum
+from time import perf_counter, time
+from typing import Dict, List, Tuple
+
+from curio.kernel import Activation
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+TRACE_MAGIC = b'CQTRACE1'
+
+# time since trace start, event, reason index, task id
+RECORD = struct.Struct('<dBHI')
+
+EVENT_CREATE = 1
+EVENT_RUN = 2
+EVENT_SUSPEND = 3
+EVENT_TERMINATE = 4
+
+
+class TraceMode(Enum):
+    """
+    How the scheduler is traced.
+    """
+    OFF = 'off'
+    LOG = 'log'
+    RING = 'ring'
+
+
+class RingTraceClass(Activation):
+    """
+    Record spawn, switch, block and termination events for a curio kernel
+    into an in-memory ring buffer.  Once the buffer is full the oldest
+    events are overwritten.
+    """
+
+    def __init__(self, capacity: int = 1 << 16, sample_every: int = 1,
+                 dump_path: str = None):
+        """
+        Set up an empty ring buffer.
+
+        :param capacity: number of events kept
+        :param sample_every: trace only tasks whose id is a multiple of
+            this (1 traces every task)
+        :param dump_path: file written when the kernel shuts down (None
+            to only dump on demand)
+        """
+        self.capacity = capacity
+        self.sample_every = sample_every
+        self.dump_path = dump_path
+        self.buffer = bytearray(RECORD.size * capacity)
+        self.count = 0
+        self.reasons = {}
+        self.task_names = {}
+        self.started = perf_counter()
+        self.started_wall = time()
+        return
+
+    def _record(self, event: int, task, reason: str = ''):
+        """
+        Pack one event into the next slot of the ring.
+
+        :param event: EVENT_* code
+        :param task: curio task the event is about
+        :param reason: why the task suspended, if it did
+        :return:
+        """
+        reason_index = self.reasons.get(reason)
+        if reason_index is None:
+            reason_index = self.reasons[reason] = len(self.reasons)
+        RECORD.pack_into(self.buffer,
+                         (self.count % self.capacity) * RECORD.size,
+                         perf_counter() - self.started, event,
+                         reason_index, task.id)
+        self.count += 1
+        return
+
+    def activate(self, kernel):
+        """
+        Arrange for the buffer to be dumped when the kernel shuts down.
+        """
+        if self.dump_path:
+            kernel._call_at_shutdown(self.dump)
+
+    def created(self, task):
+        """
+        Note a newly spawned task.
+        """
+        if task.id % self.sample_every == 0:
+            self.task_names[task.id] = task.name
+            self._record(EVENT_CREATE, task)
+
+    def running(self, task):
+        """
+        Note a task being switched in.
+        """
+        if task.id % self.sample_every == 0:
+            self._record(EVENT_RUN, task)
+
+    def suspended(self, task, trap):
+        """
+        Note a task blocking, along with the state it is waiting in.
+        """
+        if task.id % self.sample_every == 0 and not task.terminated:
+            self._record(EVENT_SUSPEND, task, task.state)
+
+    def terminated(self, task):
+        """
+        Note a task finishing.
+        """
+        if task.id % self.sample_every == 0:
+            self._record(EVENT_TERMINATE, task)
+
+    def dump(self, dump_path: str = None):
+        """
+        Write the events currently held, oldest first, to a file.
+
+        :param dump_path: file to write (default: the one given at setup)
+        :return:
+        """
+        dump_path = dump_path or self.dump_path
+        kept = min(self.count, self.capacity)
+        split = (self.count % self.capacity) * RECORD.size
+        if self.count > self.capacity:
+            records = self.buffer[split:] + self.buffer[:split]
+        else:
+            records = self.buffer[:split]
+        header = dict(started=self.started_wall, capacity=self.capacity,
+                      sample_every=self.sample_every, events=kept,
+                      dropped=self.count - kept,
+                      reasons=sorted(self.reasons, key=self.reasons.get),
+                      task_names={str(task_id): name for task_id, name
+                                  in self.task_names.items()})
+        header_bytes = json.dumps(header).encode('utf-8')
+        with open(dump_path, 'wb') as dump_file:
+            dump_file.write(TRACE_MAGIC)
+            dump_file.write(struct.pack('<I', len(header_bytes)))
+            dump_file.write(header_bytes)
+            dump_file.write(records)
+        return
+
+
+def load_trace(dump_path: str) -> Tuple[dict, List[tuple]]:
+    """
+    Read a dump written by RingTraceClass.dump.
+
+    :param dump_path: file to read
+    :return: the header and a list of (time, event, reason, task id)
+    """
+    with open(dump_path, 'rb') as dump_file:
+        data = dump_file.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f'{dump_path} is not a scheduler trace dump')
+    offset = len(TRACE_MAGIC)
+    header_size, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    header = json.loads(data[offset:offset + header_size].decode('utf-8'))
+    offset += header_size
+    reasons = header['reasons']
+    events = [(when, event, reasons[reason_index], task_id)
+              for when, event, reason_index, task_id
+              in RECORD.iter_unpack(data[offset:])]
+    return header, events
+
+
+def build_timelines(events: List[tuple]) -> Dict[int, dict]:
+    """
+    Turn the events into a run/wait timeline for each task.
+
+    :param events: as returned by load_trace
+    :return: per task id, the intervals (start, end, 'run' or wait
+        reason) and the total time spent running and in each wait
+    """
+    timelines = defaultdict(lambda: dict(intervals=[], run_time=0.0,
+                                         wait_time=defaultdict(float),
+                                         created=None, terminated=None))
+    last = {}
+    for when, event, reason, task_id in events:
+        timeline = timelines[task_id]
+        previous = last.get(task_id)
+        if previous is not None:
+            started, state = previous
+            timeline['intervals'].append((started, when, state))
+            if state == 'run':
+                timeline['run_time'] += when - started
+            else:
+                timeline['wait_time'][state] += when - started
+        if event == EVENT_CREATE:
+            timeline['created'] = when
+            last[task_id] = (when, 'READY')
+        elif event == EVENT_RUN:
+            last[task_id] = (when, 'run')
+        elif event == EVENT_SUSPEND:
+            last[task_id] = (when, reason)
+        else:
+            timeline['terminated'] = when
+            last.pop(task_id, None)
+    return timelines
+
+
+def main(argv: List[str]) -> int:
+    """
+    Print the per-task timelines from a dump.
+
+    :param argv: command line arguments
+    :return: exit status
+    """
+    parser = ArgumentParser(description='Summarise a scheduler trace dump.')
+    parser.add_argument('dump_path', help='file written by RingTraceClass')
+    parser.add_argument('--detail', action='store_true',
+                        help='list every run and wait interval')
+    args = parser.parse_args(argv)
+    header, events = load_trace(args.dump_path)
+    print(f'{header["events"]} events, {header["dropped"]} overwritten, '
+          f'sampling 1 in {header["sample_every"]} tasks')
+    timelines = build_timelines(events)
+    for task_id in sorted(timelines):
+        timeline = timelines[task_id]
+        name = header['task_names'].get(str(task_id), '?')
+        waits = ', '.join(f'{reason} {seconds * 1000:.3f}ms'
+                          for reason, seconds
+                          in sorted(timeline['wait_time'].items()))
+        print(f'task {task_id} {name}: ran '
+              f'{timeline["run_time"] * 1000:.3f}ms, waited {waits or "0"}')
+        if args.detail:
+            for started, ended, state in timeline['intervals']:
+                print(f'\t{started * 1000:10.3f} - {ended * 1000:10.3f}ms '
+                      f'{state}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+
+# EOF
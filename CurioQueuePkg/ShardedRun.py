@@ -0,0 +1,291 @@
+"""
+ShardedRun.py - Spread the word pipeline over several processes.
+
+A single curio kernel runs on a single core.  ShardedRunClass starts one
+worker process per shard, each with its own kernel, HunSpellCheckerClass
+and word_check tasks, and routes every word of a corpus to the shard
+picked by a stable hash (CRC-32) of the word as the spell checker sees it
+(lowercased).  A word therefore always goes to the same shard, so each
+shard's result cache only ever holds its own share of the vocabulary.
+
+The words go to the shards in batches through SharedRingQueueClass rings,
+one per shard.  When the corpus has been read the rings are closed, each
+shard finishes its words and hands back its counts and statistics, and
+these are merged into one report.  Good words are kept in order within a
+shard, but not across shards.  If a shard fails the routing stops, the
+rings are closed so the other shards can finish, and the shard's error is
+raised.
+"""
+
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+from curio import TaskGroup, run, run_in_executor
+from curio.meta import finalize
+
+from CurioQueuePkg.CorpusSource import CorpusSourceClass
+from CurioQueuePkg.CurioQueue import CurioQueueConsumerClass
+from CurioQueuePkg.CurioQueue import CurioQueueProducerClass, PlayCurioClass
+from CurioQueuePkg.DictionaryRegistry import get_registry
+from CurioQueuePkg.HunSpellChecker import CheckMode
+from CurioQueuePkg.LruCache import combine_stats
+from CurioQueuePkg.SharedRingQueue import SharedRingQueueClass
+from CurioQueuePkg.WordSink import CountsSinkClass
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+# ring batches taken off a shard's ring at a time
+RING_BATCHES = 16
+
+
+def shard_of(word: str, shards: int) -> int:
+    """
+    Pick the shard a word belongs to.  The same word goes to the same
+    shard in every run and every process.
+
+    :param word: the word
+    :param shards: number of shards
+    :return: shard index, 0 to shards - 1
+    """
+    return zlib.crc32(word.lower().encode('utf-8')) % shards
+
+
+class ShardPlayCurioClass(PlayCurioClass):
+    """
+    PlayCurioClass for one shard, taking its words from a ring filled by
+    the routing process.
+    """
+
+    def __init__(self, ring_name: str, **kwargs):
+        """
+        Set up the shard's pipeline.
+
+        :param ring_name: shared memory name of the shard's ring
+        :param kwargs: passed on to PlayCurioClass
+        """
+        super().__init__(word_sink=CountsSinkClass(), **kwargs)
+        self.ring_name = ring_name
+        self.words_received = 0
+        return
+
+    async def feed_ring(self):
+        """
+        Send the batches arriving on the ring through word_producer until
+        the ring is closed and drained.
+
+        :return:
+        """
+        ring = SharedRingQueueClass(self.ring_name, create=False)
+        cqc = CurioQueueConsumerClass(curio_queue=ring)
+        await cqc.consumer_start()
+        while True:
+            batches = await cqc.get_many(RING_BATCHES)
+            if not batches:
+                break
+            for batch in batches:
+                await self.word_producer.send_many(
+                    [self.number_word(word) for word in batch])
+                self.words_received += len(batch)
+            await cqc.message_done(len(batches))
+        await cqc.consumer_stop()
+        ring.detach()
+        return
+
+    def shard_results(self) -> dict:
+        """
+        Gather what the shard found and how it went.
+
+        :return: dictionary of counts and statistics
+        """
+        results = dict(pid=os.getpid(), words=self.words_received,
+                       words_checked=self.words_checked,
+                       good_words=self.good_word_count,
+                       accepted=self.word_sink.accepted,
+                       rejected=self.word_sink.rejected,
+                       cache=self.spell_checker.cache_stats(),
+                       queue=self.all_word_queue.queue_stats(),
+                       registry=get_registry().stats())
+        return results
+
+
+def _run_shard(ring_name: str, settings: dict) -> dict:
+    """
+    Run one shard's kernel.  Runs in the shard's worker process.
+
+    :param ring_name: shared memory name of the shard's ring
+    :param settings: PlayCurioClass keyword arguments
+    :return: the shard's results
+    """
+    shard = ShardPlayCurioClass(ring_name, **settings)
+    # the shard's own summary is not wanted, only the merged one
+    with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+        run(shard.run_pipeline, shard.feed_ring)
+    return shard.shard_results()
+
+
+class ShardedRunClass:
+    """
+    Check the words of a corpus on several worker processes.
+    """
+
+    def __init__(self, corpus_source: CorpusSourceClass, shards: int = 2,
+                 check_mode: CheckMode = CheckMode.INLINE,
+                 check_workers: int = 4, check_consumers: int = 1,
+                 queue_size: int = 4096,
+                 snapshot_path: Optional[str] = None,
+                 ring_capacity: int = 1 << 20, batch_size: int = 256,
+                 word_sink: Optional[CountsSinkClass] = None):
+        """
+        Set up the run.  Nothing starts until run_shards.
+
+        :param corpus_source: where the words come from
+        :param shards: number of worker processes
+        :param check_mode: where each shard runs its spell checks
+        :param check_workers: size of each shard's worker pool
+        :param check_consumers: word_check tasks in each shard
+        :param queue_size: capacity of each shard's word queues
+        :param snapshot_path: precompiled word snapshot for the shards
+        :param ring_capacity: bytes in each shard's ring
+        :param batch_size: most words routed to a shard in one message
+        :param word_sink: counts sink the shards' counts are merged into
+        """
+        self.corpus_source = corpus_source
+        self.shards = shards
+        self.settings = dict(check_mode=check_mode,
+                             check_workers=check_workers,
+                             check_consumers=check_consumers,
+                             queue_size=queue_size,
+                             snapshot_path=snapshot_path)
+        self.ring_capacity = ring_capacity
+        self.batch_size = batch_size
+        self.word_sink = word_sink or CountsSinkClass()
+        self.words_routed = [0] * shards
+        self.shard_results = []
+        return
+
+    async def route_words(self, rings: List[SharedRingQueueClass]):
+        """
+        Read the corpus and send each word to its shard's ring in batches,
+        then close the rings.
+
+        :param rings: one ring per shard
+        :return:
+        """
+        producers = [CurioQueueProducerClass(curio_queue=ring)
+                     for ring in rings]
+        for cqp in producers:
+            await cqp.producer_start()
+        pending = [[] for _ in rings]
+        async with finalize(self.corpus_source.word_batches()) as batches:
+            async for batch in batches:
+                for word in batch:
+                    index = shard_of(word, self.shards)
+                    pending[index].append(word)
+                    if len(pending[index]) >= self.batch_size:
+                        await producers[index].send_message(pending[index])
+                        self.words_routed[index] += len(pending[index])
+                        pending[index] = []
+                self.corpus_source.words_read += len(batch)
+        for index, cqp in enumerate(producers):
+            if pending[index]:
+                await cqp.send_message(pending[index])
+                self.words_routed[index] += len(pending[index])
+            await cqp.producer_close()
+        return
+
+    async def run_shards(self) -> dict:
+        """
+        Start the shards, route the corpus to them and merge what they
+        hand back.
+
+        :return: the merged statistics
+        """
+        rings = [SharedRingQueueClass(capacity=self.ring_capacity)
+                 for _ in range(self.shards)]
+        # spawned rather than forked from inside a running kernel
+        executor = ProcessPoolExecutor(max_workers=self.shards,
+                                       mp_context=get_context('spawn'))
+        try:
+            # the router runs alongside the shards, so a shard that fails
+            # cancels it rather than leaving it waiting on a full ring
+            async with TaskGroup() as shard_tasks:
+                tasks = [await shard_tasks.spawn(run_in_executor, executor,
+                                                 _run_shard, ring.name,
+                                                 self.settings)
+                         for ring in rings]
+                await shard_tasks.spawn(self.route_words, rings)
+            for task in shard_tasks.tasks:
+                if task.exception is not None and not task.cancelled:
+                    raise task.exception
+            self.shard_results = [task.result for task in tasks]
+        finally:
+            # let any shards still waiting on their rings finish
+            for ring in rings:
+                await ring.close()
+            executor.shutdown()
+            for ring in rings:
+                ring.unlink()
+        merged = self.merge_results(self.shard_results)
+        await self.word_sink.close()
+        return merged
+
+    def merge_results(self, shard_results: List[dict]) -> Dict:
+        """
+        Add the shards' counts into word_sink and their statistics up.
+
+        :param shard_results: as returned by each shard
+        :return: the merged statistics
+        """
+        for results in shard_results:
+            self.word_sink.accepted.update(results['accepted'])
+            self.word_sink.rejected.update(results['rejected'])
+            self.word_sink.accepted_count += sum(
+                results['accepted'].values())
+            self.word_sink.rejected_count += sum(
+                results['rejected'].values())
+        merged = dict(shards=len(shard_results),
+                      words=sum(results['words']
+                                for results in shard_results),
+                      words_checked=sum(results['words_checked']
+                                        for results in shard_results),
+                      good_words=sum(results['good_words']
+                                     for results in shard_results),
+                      cache=combine_stats(results['cache']
+                                          for results in shard_results),
+                      dictionary_loads=sum(results['registry']['loads']
+                                           for results in shard_results))
+        return merged
+
+    def report(self, merged: dict):
+        """
+        Print each shard's share and the merged statistics.
+
+        :param merged: as returned by run_shards
+        :return:
+        """
+        for index, results in enumerate(self.shard_results):
+            cache = results['cache']
+            print(f'Shard {index} (pid {results["pid"]}): '
+                  f'{results["words"]} words, {results["good_words"]} good, '
+                  f'{len(results["accepted"]) + len(results["rejected"])} '
+                  f'distinct, cache {cache["size"]} entries '
+                  f'({cache["hit_ratio"]:.1%} hit ratio)')
+        cache = merged['cache']
+        print(f'\n{merged["good_words"]} good words found in '
+              f'{merged["words_checked"]} words checked by '
+              f'{merged["shards"]} shards')
+        print(f'Spell check cache: {cache["hits"]} hits, '
+              f'{cache["misses"]} misses, {cache["evictions"]} evictions '
+              f'({cache["hit_ratio"]:.1%} hit ratio)')
+        print(f'Dictionaries: {merged["dictionary_loads"]} loaded across '
+              f'the shards')
+        return
+
+# EOF
@@ -0,0 +1,483 @@
+"""
+SharedRingQueue.py - A queue between curio kernels in separate processes.
+
+Sockets and multiprocessing pipes cost a system call, and usually a
+pickle, for every message.  SharedRingQueueClass instead keeps the
+messages in a ring buffer in shared memory: each record is a 4 byte
+length followed by the message as UTF-8 JSON, and the two sides only
+move their own position in the ring along.  One process puts and one
+process gets; any number of tasks in each may use the queue.  It can be
+used wherever CurioQueueProducerClass and CurioQueueConsumerClass take a
+curio queue.
+
+A side that finds nothing to do (the getter with the ring empty, the
+putter with it full or waiting in join) raises a waiting flag in the
+header and sleeps on a named pipe.  The other side only writes a byte to
+that pipe when it sees the flag, so while both sides are busy no system
+calls are made at all.  Sleepers also look again every poll_interval in
+case a wakeup crossed with the flag being raised.
+
+Header layout (unsigned 64 bit, little endian), followed by the ring::
+
+    capacity, head, tail, closed, getter_waiting, putter_waiting,
+    put_count, get_count, done_count
+
+Try it out with::
+
+    python -m CurioQueuePkg.SharedRingQueue --messages 200000
+"""
+
+import json
+import os
+import struct
+import sys
+import tempfile
+from argparse import ArgumentParser
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from time import monotonic, perf_counter
+from typing import List, Optional
+
+from curio import Lock, TaskTimeout, run, timeout_after
+from curio.traps import _read_wait
+
+from CurioQueuePkg.CurioQueue import CurioQueueClosedError, CurioQueueStatus
+from CurioQueuePkg.CurioQueue import CurioQueueConsumerClass
+from CurioQueuePkg.CurioQueue import CurioQueueProducerClass
+from CurioQueuePkg.CurioQueue import MessageEnvelopeClass
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+FIELDS = ('capacity', 'head', 'tail', 'closed', 'getter_waiting',
+          'putter_waiting', 'put_count', 'get_count', 'done_count')
+OFFSETS = {field: index * 8 for index, field in enumerate(FIELDS)}
+HEADER_SIZE = len(FIELDS) * 8
+
+FIELD = struct.Struct('<Q')
+RECORD_LENGTH = struct.Struct('<I')
+
+
+class SharedRingQueueClass:
+    """
+    Single producer, single consumer process queue in shared memory.
+
+    The process that creates the queue owns it and should unlink it when
+    done.  Other processes attach by name, and must be started from the
+    owner with multiprocessing so that they share its resource tracker.
+    """
+
+    def __init__(self, name: Optional[str] = None, capacity: int = 1 << 20,
+                 create: bool = True, poll_interval: float = 0.05):
+        """
+        Create a queue or attach to an existing one.
+
+        :param name: shared memory name (None to pick one when creating)
+        :param capacity: bytes in the ring, when creating
+        :param create: create the queue rather than attach to it
+        :param poll_interval: longest a sleeping side waits before
+            looking again without being woken
+        """
+        if create:
+            self.shm = SharedMemory(name=name, create=True,
+                                    size=HEADER_SIZE + capacity)
+            self.shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+            FIELD.pack_into(self.shm.buf, OFFSETS['capacity'], capacity)
+            for wake_path in self._wake_paths(self.shm.name):
+                os.mkfifo(wake_path)
+        else:
+            self.shm = SharedMemory(name=name)
+        self.name = self.shm.name
+        self.owner = create
+        self.buf = self.shm.buf
+        self.capacity = self._field('capacity')
+        self.poll_interval = poll_interval
+        getter_path, putter_path = self._wake_paths(self.name)
+        # opened for reading and writing so neither open waits for the
+        # other side
+        self.getter_wake = os.open(getter_path, os.O_RDWR | os.O_NONBLOCK)
+        self.putter_wake = os.open(putter_path, os.O_RDWR | os.O_NONBLOCK)
+        self.get_lock = Lock()
+        self.put_lock = Lock()
+        self.maxsize = 0
+        self.high_watermark = 0
+        self.put_blocked_count = 0
+        self.put_blocked_time = 0.0
+        self.wakeups_sent = 0
+        self.sleeps = 0
+        return
+
+    @staticmethod
+    def _wake_paths(name: str) -> tuple:
+        """
+        Named pipes the getter and the putter sleep on.
+
+        :param name: shared memory name
+        :return: (getter pipe, putter pipe)
+        """
+        base = os.path.join(tempfile.gettempdir(), name.lstrip('/'))
+        return f'{base}.get-wake', f'{base}.put-wake'
+
+    def _field(self, field: str) -> int:
+        """
+        Read a header field.
+
+        :param field: name from FIELDS
+        :return: its value
+        """
+        return FIELD.unpack_from(self.buf, OFFSETS[field])[0]
+
+    def _set_field(self, field: str, value: int):
+        """
+        Write a header field.
+
+        :param field: name from FIELDS
+        :param value: new value
+        :return:
+        """
+        FIELD.pack_into(self.buf, OFFSETS[field], value)
+        return
+
+    def _write(self, position: int, data: bytes):
+        """
+        Copy bytes into the ring, wrapping round its end.
+
+        :param position: ring position (not yet reduced by the capacity)
+        :param data: bytes to copy
+        :return:
+        """
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.buf[HEADER_SIZE + start:HEADER_SIZE + start + first] = \
+            data[:first]
+        if first < len(data):
+            self.buf[HEADER_SIZE:HEADER_SIZE + len(data) - first] = \
+                data[first:]
+        return
+
+    def _read(self, position: int, size: int) -> bytes:
+        """
+        Copy bytes out of the ring, wrapping round its end.
+
+        :param position: ring position (not yet reduced by the capacity)
+        :param size: bytes to copy
+        :return: the bytes
+        """
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(
+            self.buf[HEADER_SIZE + start:HEADER_SIZE + start + first])
+        if first < size:
+            data += bytes(self.buf[HEADER_SIZE:HEADER_SIZE + size - first])
+        return data
+
+    def _wake(self, flag: str, wake_fd: int):
+        """
+        Wake the other side if it has said it is sleeping.
+
+        :param flag: the other side's waiting flag
+        :param wake_fd: the pipe it sleeps on
+        :return:
+        """
+        if self._field(flag):
+            self._set_field(flag, 0)
+            try:
+                os.write(wake_fd, b'\0')
+            except BlockingIOError:
+                # the pipe is full of wakeups already
+                pass
+            self.wakeups_sent += 1
+        return
+
+    async def _sleep(self, flag: str, wake_fd: int, ready):
+        """
+        Raise a waiting flag and sleep until woken, unless ready() turns
+        true meanwhile.
+
+        :param flag: this side's waiting flag
+        :param wake_fd: the pipe this side sleeps on
+        :param ready: function telling whether there is no need to sleep
+        :return:
+        """
+        self._set_field(flag, 1)
+        if not ready():
+            self.sleeps += 1
+            try:
+                await timeout_after(self.poll_interval, _read_wait, wake_fd)
+                os.read(wake_fd, 4096)
+            except (TaskTimeout, BlockingIOError):
+                pass
+        self._set_field(flag, 0)
+        return
+
+    @property
+    def status(self) -> CurioQueueStatus:
+        """
+        Whether the queue has been closed.
+
+        :return: the state of the queue
+        """
+        if self._field('closed'):
+            return CurioQueueStatus.QUEUE_CLOSED
+        return CurioQueueStatus.QUEUE_OPEN
+
+    def qsize(self) -> int:
+        """
+        Messages in the ring.
+
+        :return: the count
+        """
+        return self._field('put_count') - self._field('get_count')
+
+    def empty(self) -> bool:
+        """
+        Whether the ring is empty.
+
+        :return: true if there is nothing to get
+        """
+        return self._field('head') == self._field('tail')
+
+    def full(self) -> bool:
+        """
+        Whether the ring has no room for even an empty record.
+
+        :return: true if put would wait
+        """
+        used = self._field('head') - self._field('tail')
+        return self.capacity - used < RECORD_LENGTH.size
+
+    async def put(self, item):
+        """
+        Add a message, waiting for room if the ring is full.
+
+        :param item: message to add; envelopes lose their timings
+        :return:
+        """
+        if isinstance(item, MessageEnvelopeClass):
+            item = item.payload
+        data = json.dumps(item, separators=(',', ':')).encode('utf-8')
+        size = RECORD_LENGTH.size + len(data)
+        if size > self.capacity:
+            raise ValueError(f'A {size} byte message does not fit in the '
+                             f'ring')
+        async with self.put_lock:
+            started = None
+            while True:
+                if self._field('closed'):
+                    raise CurioQueueClosedError('Queue is closed')
+                head = self._field('head')
+                if self.capacity - (head - self._field('tail')) >= size:
+                    break
+                if started is None:
+                    started = monotonic()
+                await self._sleep(
+                    'putter_waiting', self.putter_wake,
+                    lambda: (self.capacity - (head - self._field('tail')) >=
+                             size or self._field('closed')))
+            self._write(head, RECORD_LENGTH.pack(len(data)) + data)
+            self._set_field('put_count', self._field('put_count') + 1)
+            # publish the record only once it is all there
+            self._set_field('head', head + size)
+        self._wake('getter_waiting', self.getter_wake)
+        if started is not None:
+            self.put_blocked_count += 1
+            self.put_blocked_time += monotonic() - started
+        self.high_watermark = max(self.high_watermark, self.qsize())
+        return
+
+    async def get(self):
+        """
+        Take the next message, waiting for one if the ring is empty.
+
+        :return: the message
+        """
+        async with self.get_lock:
+            while True:
+                tail = self._field('tail')
+                if self._field('head') != tail:
+                    break
+                if self._field('closed'):
+                    raise CurioQueueClosedError('Queue is closed and empty')
+                await self._sleep(
+                    'getter_waiting', self.getter_wake,
+                    lambda: (self._field('head') != tail or
+                             self._field('closed')))
+            length, = RECORD_LENGTH.unpack(
+                self._read(tail, RECORD_LENGTH.size))
+            data = self._read(tail + RECORD_LENGTH.size, length)
+            self._set_field('get_count', self._field('get_count') + 1)
+            self._set_field('tail', tail + RECORD_LENGTH.size + length)
+        self._wake('putter_waiting', self.putter_wake)
+        return json.loads(data.decode('utf-8'))
+
+    async def task_done(self):
+        """
+        Count a message as dealt with.
+
+        :return:
+        """
+        self._set_field('done_count', self._field('done_count') + 1)
+        self._wake('putter_waiting', self.putter_wake)
+        return
+
+    async def join(self):
+        """
+        Wait until every message put has been dealt with.
+
+        :return:
+        """
+        async with self.put_lock:
+            while self._field('done_count') < self._field('put_count'):
+                await self._sleep(
+                    'putter_waiting', self.putter_wake,
+                    lambda: (self._field('done_count') >=
+                             self._field('put_count')))
+        return
+
+    async def close(self):
+        """
+        Close the queue.  Messages already in the ring can still be
+        taken.
+
+        :return:
+        """
+        self._set_field('closed', 1)
+        self._wake('getter_waiting', self.getter_wake)
+        self._wake('putter_waiting', self.putter_wake)
+        return
+
+    def queue_stats(self) -> dict:
+        """
+        Report the queue counters.  The capacity is in bytes, so maxsize
+        is reported as 0.
+
+        :return: dictionary of depth, put and wakeup counters
+        """
+        stats = dict(status=self.status.value, depth=self.qsize(),
+                     maxsize=self.maxsize, capacity_bytes=self.capacity,
+                     used_bytes=self._field('head') - self._field('tail'),
+                     high_watermark=self.high_watermark,
+                     put_count=self._field('put_count'),
+                     put_blocked_count=self.put_blocked_count,
+                     put_blocked_time=self.put_blocked_time,
+                     wakeups_sent=self.wakeups_sent, sleeps=self.sleeps)
+        return stats
+
+    def detach(self):
+        """
+        Let go of the shared memory and the pipes in this process.
+
+        :return:
+        """
+        os.close(self.getter_wake)
+        os.close(self.putter_wake)
+        self.buf = None
+        self.shm.close()
+        return
+
+    def unlink(self):
+        """
+        Remove the shared memory and the pipes.  Only the owner should.
+
+        :return:
+        """
+        self.detach()
+        self.shm.unlink()
+        for wake_path in self._wake_paths(self.name):
+            os.unlink(wake_path)
+        return
+
+
+async def _count_messages(name: str) -> int:
+    """
+    Take messages off a queue until it is closed.
+
+    :param name: shared memory name of the queue
+    :return: the number of messages taken
+    """
+    ring = SharedRingQueueClass(name, create=False)
+    cqc = CurioQueueConsumerClass(curio_queue=ring)
+    await cqc.consumer_start()
+    received = 0
+    while True:
+        msgs = await cqc.get_many(256)
+        if not msgs:
+            break
+        received += len(msgs)
+        await cqc.message_done(len(msgs))
+    await cqc.consumer_stop()
+    ring.detach()
+    return received
+
+
+def _consumer_process(name: str):
+    """
+    Run a curio kernel consuming the queue.  Runs in the child process.
+
+    :param name: shared memory name of the queue
+    :return:
+    """
+    received = run(_count_messages, name)
+    print(f'Consumer process {os.getpid()} received {received} messages')
+    return
+
+
+async def _send_messages(ring: SharedRingQueueClass, messages: int):
+    """
+    Send numbered words through the queue and wait for them to be taken.
+
+    :param ring: the queue
+    :param messages: how many to send
+    :return:
+    """
+    cqp = CurioQueueProducerClass(curio_queue=ring)
+    await cqp.producer_start()
+    batch = 256
+    for start in range(0, messages, batch):
+        await cqp.send_many((seq, 'word') for seq in
+                            range(start, min(start + batch, messages)))
+    await cqp.producer_join()
+    await cqp.producer_close()
+    return
+
+
+def main(argv: List[str]) -> int:
+    """
+    Time messages sent to a curio kernel in another process.
+
+    :param argv: command line arguments
+    :return: exit status
+    """
+    parser = ArgumentParser(description='Send messages through a shared '
+                                        'memory ring to another process.')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--capacity', type=int, default=1 << 20,
+                        help='ring size in bytes')
+    args = parser.parse_args(argv)
+
+    ring = SharedRingQueueClass(capacity=args.capacity)
+    consumer = get_context('spawn').Process(target=_consumer_process,
+                                            args=(ring.name,))
+    consumer.start()
+    try:
+        started = perf_counter()
+        run(_send_messages, ring, args.messages)
+        seconds = perf_counter() - started
+        consumer.join()
+        stats = ring.queue_stats()
+    finally:
+        ring.unlink()
+    print(f'{args.messages} messages in {seconds:.3f}s '
+          f'({args.messages / seconds:.0f}/s); the producer sent '
+          f'{stats["wakeups_sent"]} wakeups, slept {stats["sleeps"]} times '
+          f'and was blocked on a full ring {stats["put_blocked_count"]} '
+          f'times')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+
+# EOF
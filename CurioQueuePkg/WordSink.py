@@ -0,0 +1,495 @@
+"""
+WordSink.py - Batched output for the words coming out of the pipeline.
+
+Printing every word as it is checked makes stdout the bottleneck once the
+input runs to millions of words.  A sink instead gathers the accepted and
+rejected words into a buffer and writes the buffer out in one go once it
+holds batch_size lines, and a background task writes out whatever is
+buffered every flush_interval seconds, so lines do not wait through a lull
+in the input.  The writes themselves run on a worker thread so the event
+loop is never held up by the disk or the terminal.  Suggestions for the
+rejected words, when they are looked up, go through the same sink.
+
+    ConsoleSinkClass    the demo's output: rejected words as they come,
+                        the good words listed at the end
+    TextFileSinkClass   the same lines written to a plain text file
+    NdjsonSinkClass     one JSON object per word
+    CountsSinkClass     only counts per word, summarised at the end
+"""
+
+import json
+import sys
+from abc import ABC, abstractmethod
+from collections import Counter
+from enum import Enum
+from time import monotonic
+from typing import Iterable, List, Optional, TextIO, Tuple
+
+from curio import Event, Lock, ignore_after, run_in_thread, spawn
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+# a rejected word and its corrections (None if the lookup ran out of time)
+SuggestionRecord = Tuple[str, Optional[Tuple[str, ...]]]
+
+
+class SinkKind(Enum):
+    """
+    Where the checked words are written.
+    """
+    CONSOLE = 'console'
+    TEXT = 'text'
+    NDJSON = 'ndjson'
+    COUNTS = 'counts'
+
+
+class WordSinkClass(ABC):
+    """
+    Buffer lines and write them out in batches off the event loop.
+    Subclasses decide what the lines look like and where they go.
+    """
+
+    def __init__(self, batch_size: int = 4096, flush_interval: float = 1.0):
+        """
+        Set up an empty buffer.
+
+        :param batch_size: lines held before they are written
+        :param flush_interval: longest time in seconds a line waits in the
+            buffer
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flush_lock = Lock()
+        self.last_flush = monotonic()
+        self.flush_task = None
+        self.closing = Event()
+        self.accepted_count = 0
+        self.rejected_count = 0
+        self.suggestion_count = 0
+        return
+
+    async def accept(self, words: Iterable[str]):
+        """
+        Record words that passed the spell check.
+
+        :param words: the good words
+        :return:
+        """
+        lines = [self.format_accepted(word) for word in words]
+        self.accepted_count += len(lines)
+        await self._add(lines)
+        return
+
+    async def reject(self, words: Iterable[str]):
+        """
+        Record words that failed the spell check.
+
+        :param words: the rejected words
+        :return:
+        """
+        lines = [self.format_rejected(word) for word in words]
+        self.rejected_count += len(lines)
+        await self._add(lines)
+        return
+
+    async def suggestions(self, records: Iterable[SuggestionRecord]):
+        """
+        Record the corrections found for rejected words.
+
+        :param records: (word, suggestions) pairs; suggestions is None if
+            the lookup ran out of time
+        :return:
+        """
+        lines = [self.format_suggestions(word, suggestions)
+                 for word, suggestions in records]
+        self.suggestion_count += len(lines)
+        await self._add(lines)
+        return
+
+    def format_suggestions(self, word: str,
+                           suggestions: Optional[Tuple[str, ...]]) -> str:
+        """
+        Line written for the suggestions for a rejected word.
+
+        :param word: the rejected word
+        :param suggestions: the corrections, or None if out of time
+        :return: the line, including its newline
+        """
+        if suggestions is None:
+            return f'{word} suggestions: (out of time)\n'
+        return f'{word} suggestions: {", ".join(suggestions) or "(none)"}\n'
+
+    def format_accepted(self, word: str) -> str:
+        """
+        Line written for a good word.
+
+        :param word: the word
+        :return: the line, including its newline
+        """
+        return f'{word}\n'
+
+    def format_rejected(self, word: str) -> str:
+        """
+        Line written for a rejected word.
+
+        :param word: the word
+        :return: the line, including its newline
+        """
+        return f'{word} rejected by Hunspell\n'
+
+    async def _add(self, lines: List[str]):
+        """
+        Buffer lines, writing the buffer out if it is full.
+
+        :param lines: lines to add
+        :return:
+        """
+        self.buffer.extend(lines)
+        if self.flush_task is None:
+            self.flush_task = await spawn(self._flush_periodically,
+                                          daemon=True)
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+        return
+
+    async def _flush_periodically(self):
+        """
+        Write out the buffer whenever flush_interval seconds have passed
+        since the last write, until the sink is closed.
+
+        :return:
+        """
+        while not self.closing.is_set():
+            due = self.last_flush + self.flush_interval - monotonic()
+            if due > 0:
+                await ignore_after(due, self.closing.wait)
+            else:
+                await self.flush()
+        return
+
+    async def _stop_flushing(self):
+        """
+        Stop the periodic writes, letting one under way finish.
+
+        :return:
+        """
+        await self.closing.set()
+        if self.flush_task is not None:
+            await self.flush_task.join()
+        return
+
+    async def flush(self):
+        """
+        Write out everything buffered so far.
+
+        :return:
+        """
+        async with self.flush_lock:
+            lines = self.buffer
+            self.buffer = []
+            self.last_flush = monotonic()
+            if lines:
+                await run_in_thread(self.write_lines, lines)
+        return
+
+    @abstractmethod
+    def write_lines(self, lines: List[str]):
+        """
+        Write a batch of lines.  Runs on a worker thread.
+
+        :param lines: lines to write
+        :return:
+        """
+
+    async def close(self):
+        """
+        Write out whatever is left and release the output.
+
+        :return:
+        """
+        await self._stop_flushing()
+        await self.flush()
+        return
+
+
+class TextFileSinkClass(WordSinkClass):
+    """
+    Write the good words, and the rejected ones with a note, to a plain
+    text file.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        """
+        Open the output file.
+
+        :param path: file to write (replaced if it exists)
+        :param kwargs: batch_size and flush_interval
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self.out_file = open(path, 'w', buffering=1 << 16)
+        return
+
+    def write_lines(self, lines: List[str]):
+        """
+        Append a batch of lines to the file.
+
+        :param lines: lines to write
+        :return:
+        """
+        self.out_file.write(''.join(lines))
+        self.out_file.flush()
+        return
+
+    async def close(self):
+        """
+        Write out whatever is left and close the file.
+
+        :return:
+        """
+        await self._stop_flushing()
+        await self.flush()
+        await run_in_thread(self.out_file.close)
+        return
+
+
+class NdjsonSinkClass(TextFileSinkClass):
+    """
+    Write one JSON object per word, e.g. {"word": "gem", "ok": true}.
+    """
+
+    def format_accepted(self, word: str) -> str:
+        """
+        JSON line for a good word.
+
+        :param word: the word
+        :return: the line, including its newline
+        """
+        return json.dumps(dict(word=word, ok=True)) + '\n'
+
+    def format_rejected(self, word: str) -> str:
+        """
+        JSON line for a rejected word.
+
+        :param word: the word
+        :return: the line, including its newline
+        """
+        return json.dumps(dict(word=word, ok=False)) + '\n'
+
+    def format_suggestions(self, word: str,
+                           suggestions: Optional[Tuple[str, ...]]) -> str:
+        """
+        JSON line for the suggestions for a rejected word (null if the
+        lookup ran out of time).
+
+        :param word: the rejected word
+        :param suggestions: the corrections, or None if out of time
+        :return: the line, including its newline
+        """
+        return json.dumps(dict(
+            word=word, suggestions=None if suggestions is None
+            else list(suggestions))) + '\n'
+
+
+class ConsoleSinkClass(WordSinkClass):
+    """
+    Print the rejected words as they are written out and list the good
+    words at the end, as the demo always has.
+    """
+
+    def __init__(self, stream: TextIO = None, **kwargs):
+        """
+        Set up the sink.
+
+        :param stream: where to print (default: standard output)
+        :param kwargs: batch_size and flush_interval
+        """
+        super().__init__(**kwargs)
+        self.stream = stream
+        self.good_words = []
+        return
+
+    async def accept(self, words: Iterable[str]):
+        """
+        Hold on to the good words until the end.
+
+        :param words: the good words
+        :return:
+        """
+        words = list(words)
+        self.accepted_count += len(words)
+        self.good_words.extend(words)
+        return
+
+    def write_lines(self, lines: List[str]):
+        """
+        Print a batch of lines in one write.
+
+        :param lines: lines to print
+        :return:
+        """
+        stream = self.stream or sys.stdout
+        stream.write(''.join(lines))
+        stream.flush()
+        return
+
+    async def close(self):
+        """
+        Print the rejected words still buffered, then the good words.
+
+        :return:
+        """
+        await self._stop_flushing()
+        await self.flush()
+        lines = ['\nGood words found:\n']
+        lines += [f'\t{word}\n' for word in self.good_words]
+        await run_in_thread(self.write_lines, lines)
+        return
+
+
+class CountsSinkClass(WordSinkClass):
+    """
+    Count how often each word was accepted or rejected and report only the
+    totals and the most frequent words.
+    """
+
+    def __init__(self, path: Optional[str] = None, top: int = 10,
+                 **kwargs):
+        """
+        Set up the counters.
+
+        :param path: file the summary is written to as JSON (None to
+            print it)
+        :param top: number of most frequent words reported
+        :param kwargs: accepted for the same signature as the other sinks
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self.top = top
+        self.accepted = Counter()
+        self.rejected = Counter()
+        self.suggested = {}
+        self.unanswered = 0
+        return
+
+    async def accept(self, words: Iterable[str]):
+        """
+        Count the good words.
+
+        :param words: the good words
+        :return:
+        """
+        words = list(words)
+        self.accepted_count += len(words)
+        self.accepted.update(words)
+        return
+
+    async def reject(self, words: Iterable[str]):
+        """
+        Count the rejected words.
+
+        :param words: the rejected words
+        :return:
+        """
+        words = list(words)
+        self.rejected_count += len(words)
+        self.rejected.update(words)
+        return
+
+    async def suggestions(self, records: Iterable[SuggestionRecord]):
+        """
+        Keep the best suggestion for each rejected word.
+
+        :param records: (word, suggestions) pairs
+        :return:
+        """
+        for word, suggestions in records:
+            self.suggestion_count += 1
+            if suggestions is None:
+                self.unanswered += 1
+            elif suggestions:
+                self.suggested[word] = suggestions[0]
+        return
+
+    def write_lines(self, lines: List[str]):
+        """
+        Nothing to write; the words are counted rather than buffered.
+
+        :param lines: lines to write (always none)
+        :return:
+        """
+        return
+
+    def summary(self) -> dict:
+        """
+        Totals and the most frequent words.
+
+        :return: dictionary of the counts
+        """
+        summary = dict(accepted=self.accepted_count,
+                       rejected=self.rejected_count,
+                       distinct_accepted=len(self.accepted),
+                       distinct_rejected=len(self.rejected),
+                       top_accepted=self.accepted.most_common(self.top),
+                       top_rejected=self.rejected.most_common(self.top),
+                       suggestions=self.suggestion_count,
+                       suggestions_out_of_time=self.unanswered)
+        return summary
+
+    def write_summary(self, summary: dict):
+        """
+        Write the summary out.  Runs on a worker thread.
+
+        :param summary: as returned by summary
+        :return:
+        """
+        if self.path:
+            with open(self.path, 'w') as out_file:
+                json.dump(summary, out_file, indent=2)
+            return
+        print(f'\n{summary["accepted"]} good words '
+              f'({summary["distinct_accepted"]} distinct), '
+              f'{summary["rejected"]} rejected '
+              f'({summary["distinct_rejected"]} distinct)')
+        for word, count in summary['top_rejected']:
+            best = self.suggested.get(word)
+            print(f'\t{word} rejected {count} times'
+                  f'{f" (did you mean {best}?)" if best else ""}')
+        return
+
+    async def close(self):
+        """
+        Write out the summary.
+
+        :return:
+        """
+        await run_in_thread(self.write_summary, self.summary())
+        return
+
+
+def make_sink(kind: SinkKind, path: Optional[str] = None,
+              **kwargs) -> WordSinkClass:
+    """
+    Create a sink of the given kind.
+
+    :param kind: which sink
+    :param path: output file (needed for TEXT and NDJSON, optional for
+        COUNTS, ignored for CONSOLE)
+    :param kwargs: batch_size and flush_interval
+    :return: the sink
+    """
+    if kind == SinkKind.CONSOLE:
+        return ConsoleSinkClass(**kwargs)
+    if kind == SinkKind.COUNTS:
+        return CountsSinkClass(path, **kwargs)
+    if path is None:
+        raise ValueError(f'A {kind.value} sink needs an output path')
+    if kind == SinkKind.TEXT:
+        return TextFileSinkClass(path, **kwargs)
+    return NdjsonSinkClass(path, **kwargs)
+
+# EOF
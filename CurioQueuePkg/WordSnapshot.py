@@ -0,0 +1,186 @@
+"""
+WordSnapshot.py - A precompiled, memory mapped word list for fast lookups.
+
+Hunspell parses its .dic and .aff files every time a dictionary is
+loaded.  A snapshot is the expanded word list (e.g. the output of
+Hunspell's unmunch tool, or any list of words) sorted and written once to
+a binary file that can be memory mapped in a few milliseconds.  Exact
+matches are answered from the snapshot by a binary search; anything not
+in it can still be passed on to Hunspell.
+
+File layout (little endian)::
+
+    magic        8 bytes, b'CQWORDS1'
+    count        u32, number of words
+    offsets      (count + 1) x u32, start of each word in the word data
+    word data    the words, UTF-8, sorted, back to back
+
+Build and try out a snapshot with::
+
+    python -m CurioQueuePkg.WordSnapshot build words.txt words.snap
+    python -m CurioQueuePkg.WordSnapshot lookup words.snap gem baad
+"""
+
+import mmap
+import struct
+import sys
+from argparse import ArgumentParser
+from typing import Iterable, List, Optional
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+SNAPSHOT_MAGIC = b'CQWORDS1'
+
+COUNT = struct.Struct('<I')
+OFFSET = struct.Struct('<I')
+
+
+def build_snapshot(words: Iterable[str], snapshot_path: str,
+                   verify_lang: Optional[str] = None) -> int:
+    """
+    Write a snapshot of a word list.
+
+    Words are lowercased, as the spell checker lowercases every word it is
+    asked about, and duplicates are dropped.
+
+    :param words: the words to include
+    :param snapshot_path: file to write
+    :param verify_lang: if given, only keep the words the Hunspell
+        dictionary for this language accepts, so the snapshot never
+        disagrees with Hunspell
+    :return: number of words written
+    """
+    unique = {word.strip().lower() for word in words}
+    unique.discard('')
+    if verify_lang is not None:
+        # the registry opens snapshots, so import it only when needed
+        from CurioQueuePkg.DictionaryRegistry import get_dictionary
+        dictionary = get_dictionary(verify_lang)
+        unique = {word for word in unique if dictionary.spell(word)}
+    encoded = sorted(word.encode('utf-8') for word in unique)
+    offsets = [0]
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+    with open(snapshot_path, 'wb') as snapshot_file:
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        snapshot_file.write(COUNT.pack(len(encoded)))
+        snapshot_file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        snapshot_file.write(b''.join(encoded))
+    return len(encoded)
+
+
+class WordSnapshotClass:
+    """
+    Read-only, memory mapped view of a snapshot.  Safe to share between
+    threads.
+    """
+
+    def __init__(self, snapshot_path: str):
+        """
+        Map a snapshot file.
+
+        :param snapshot_path: file written by build_snapshot
+        """
+        self.path = snapshot_path
+        with open(snapshot_path, 'rb') as snapshot_file:
+            self.mapped = mmap.mmap(snapshot_file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        if self.mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            self.mapped.close()
+            raise ValueError(f'{snapshot_path} is not a word snapshot')
+        self.count, = COUNT.unpack_from(self.mapped, len(SNAPSHOT_MAGIC))
+        self.offsets_start = len(SNAPSHOT_MAGIC) + COUNT.size
+        self.words_start = self.offsets_start + (self.count + 1) * OFFSET.size
+        return
+
+    def __len__(self) -> int:
+        """
+        Number of words in the snapshot.
+
+        :return: the word count
+        """
+        return self.count
+
+    def _word_at(self, index: int) -> bytes:
+        """
+        Fetch the word at a position in the sorted list.
+
+        :param index: position
+        :return: the word, still encoded
+        """
+        start, end = struct.unpack_from(
+            '<2I', self.mapped, self.offsets_start + index * OFFSET.size)
+        return self.mapped[self.words_start + start:self.words_start + end]
+
+    def __contains__(self, word: str) -> bool:
+        """
+        Binary search the snapshot for an exact match.
+
+        :param word: word to look for (already lowercased)
+        :return: true if the word is in the snapshot
+        """
+        target = word.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._word_at(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self._word_at(low) == target
+
+    def close(self):
+        """
+        Unmap the file.
+
+        :return:
+        """
+        self.mapped.close()
+        return
+
+
+def main(argv: List[str]) -> int:
+    """
+    Build a snapshot from a word list, or look words up in one.
+
+    :param argv: command line arguments
+    :return: exit status
+    """
+    parser = ArgumentParser(description='Build or query a word snapshot.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser(
+        'build', help='build a snapshot from a word list')
+    build_parser.add_argument('word_list',
+                              help='text file with one word per line')
+    build_parser.add_argument('snapshot_path', help='snapshot file to write')
+    build_parser.add_argument('--verify', metavar='LANG',
+                              help='keep only the words this Hunspell '
+                                   'dictionary accepts')
+    lookup_parser = commands.add_parser('lookup',
+                                        help='look words up in a snapshot')
+    lookup_parser.add_argument('snapshot_path')
+    lookup_parser.add_argument('words', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        with open(args.word_list, encoding='utf-8',
+                  errors='ignore') as word_file:
+            count = build_snapshot(word_file, args.snapshot_path,
+                                   verify_lang=args.verify)
+        print(f'{count} words written to {args.snapshot_path}')
+        return 0
+    snapshot = WordSnapshotClass(args.snapshot_path)
+    for word in args.words:
+        found = word.lower() in snapshot
+        print(f'{word}: {"found" if found else "not found"}')
+    snapshot.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+
+# EOF
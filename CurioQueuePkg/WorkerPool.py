@@ -0,0 +1,196 @@
+"""
+WorkerPool.py - A warm process pool shared by the curio pipelines.
+
+curio.run_in_process starts its worker processes inside each kernel and
+throws them away when the kernel ends, and every worker has to import the
+compute code the first time it is used.  The pool here lives for the
+whole program, imports the compute modules up front in every worker, and
+keeps track of how much each call costs beyond the work itself so that it
+is easy to tell when offloading pays off.  The workers are spawned rather
+than forked and are shut down when the program exits.  Work that must not
+queue behind the rest, such as spelling suggestions, gets a named pool of
+its own.
+"""
+
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from logging import debug
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+from curio import TaskGroup, run_in_executor
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+# modules imported by every worker as it starts
+PRELOAD_MODULES = ('CurioQueuePkg.FibCompute',)
+
+_shared_pool = None
+
+# pools kept apart from the shared one, keyed by name and size
+_named_pools = {}
+
+
+def _preload(module_names: Iterable[str]):
+    """
+    Import the compute modules when a worker process starts.
+
+    :param module_names: dotted names of the modules to import
+    :return:
+    """
+    for module_name in module_names:
+        import_module(module_name)
+    return
+
+
+def _warm_up() -> int:
+    """
+    Do nothing, so that a worker gets started.
+
+    :return: the worker's pid
+    """
+    return os.getpid()
+
+
+def _timed_call(func: Callable, args: Tuple) -> Tuple[Any, float]:
+    """
+    Run func(*args) in the worker and time it.
+
+    :param func: function to run
+    :param args: its arguments
+    :return: the result and the seconds spent computing it
+    """
+    started = perf_counter()
+    result = func(*args)
+    return result, perf_counter() - started
+
+
+class WarmProcessPoolClass:
+    """
+    A process pool that is started once and reused by every curio kernel
+    in the program.
+    """
+
+    def __init__(self, workers: Optional[int] = None,
+                 preload: Iterable[str] = PRELOAD_MODULES):
+        """
+        Set up the pool.  The worker processes are started on first use.
+
+        :param workers: number of worker processes (default: CPU count)
+        :param preload: modules each worker imports as it starts
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.preload = tuple(preload)
+        self.executor = None
+        self.calls = 0
+        self.call_time = 0.0
+        self.compute_time = 0.0
+        return
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        Start the executor if it is not running yet.
+
+        :return: the executor
+        """
+        if self.executor is None:
+            debug(f'Starting process pool of {self.workers} workers')
+            # spawned, as forked workers would inherit the kernel's
+            # listening sockets (monitor, metrics) and keep them open
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_preload,
+                initargs=(self.preload,), mp_context=get_context('spawn'))
+        return self.executor
+
+    async def warm_up(self):
+        """
+        Start every worker process now rather than on the first calls.
+
+        :return:
+        """
+        executor = self._get_executor()
+        async with TaskGroup() as warm_tasks:
+            for _ in range(self.workers):
+                await warm_tasks.spawn(run_in_executor, executor, _warm_up)
+        return
+
+    async def run(self, func: Callable, *args) -> Any:
+        """
+        Run func(*args) in one of the workers.
+
+        :param func: a picklable, module level function
+        :param args: its (picklable) arguments
+        :return: the result of the call
+        """
+        started = perf_counter()
+        result, compute_time = await run_in_executor(
+            self._get_executor(), _timed_call, func, args)
+        self.calls += 1
+        self.call_time += perf_counter() - started
+        self.compute_time += compute_time
+        return result
+
+    def dispatch_stats(self) -> dict:
+        """
+        Report how much the calls cost beyond the work done in the workers.
+
+        :return: dictionary of call counts and times in seconds
+        """
+        overhead = self.call_time - self.compute_time
+        mean_overhead = overhead / self.calls if self.calls else 0.0
+        stats = dict(calls=self.calls, call_time=self.call_time,
+                     compute_time=self.compute_time, overhead=overhead,
+                     mean_overhead=mean_overhead)
+        return stats
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+
+        :return:
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        return
+
+
+def get_shared_pool() -> WarmProcessPoolClass:
+    """
+    Return the program-wide process pool, creating it on first use.
+
+    :return: the shared pool
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = WarmProcessPoolClass()
+        atexit.register(_shared_pool.shutdown)
+    return _shared_pool
+
+
+def get_named_pool(name: str, workers: int,
+                   preload: Iterable[str] = ()) -> WarmProcessPoolClass:
+    """
+    Return a program-wide process pool of its own for one kind of work,
+    creating it on first use, so that slow jobs there never hold up the
+    shared pool.
+
+    :param name: what the pool is for
+    :param workers: number of worker processes
+    :param preload: modules each worker imports as it starts
+    :return: the pool
+    """
+    key = (name, workers)
+    pool = _named_pools.get(key)
+    if pool is None:
+        pool = _named_pools[key] = WarmProcessPoolClass(workers, preload)
+        atexit.register(pool.shutdown)
+    return pool
+
+# EOF
@@ -4,11 +4,16 @@ curio_demo_11.py - Curio tutorial.
 (from https://curio.readthedocs.io/en/latest/tutorial.html)
 
 Kid uses Fibonacci numbers for building the Minecraft game.
+
+Uses the fast Fibonacci module from CurioQueuePkg, so run it from the top
+of the repository as: python -m Curio_demo_pkg.curio_demo_11
 """
 
 import curio
 import signal
 
+from CurioQueuePkg.FibCompute import fib_table
+
 # an event object for tracking permission from the parent
 start_evt = curio.Event()
 
@@ -41,17 +46,6 @@ async def friend(name):
         print(f'{name} going home')
         raise
 
-def fib(n):
-    """
-    Compute the n'th Fibonacci number.
-    :param n: target Fibonacci number
-    :return: the appropriate number
-    """
-    if n <=2:
-        return 1
-    else:
-        return fib(n-1) + fib(n-2)
-
 
 async def kid():
     """
@@ -90,8 +84,8 @@ async def kid():
         await f.spawn(friend, 'Thomas')
         try:
             total = 0
-            for fib_nbr in range(50):
-                total += fib(fib_nbr)
+            for fib_nbr, fib_value in enumerate(fib_table(49)):
+                total += fib_value
                 print(f'Total so far is {total} for {fib_nbr}')
             await curio.sleep(1000)
         except curio.CancelledError as xcp:
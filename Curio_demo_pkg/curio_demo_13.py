@@ -5,11 +5,21 @@ curio_demo_13.py - Curio tutorial.
 
 Kid uses Fibonacci numbers for building the Minecraft game, buy now runs it
 in a separate thread with a hard sleep.
+
+Uses the Fibonacci, concurrent map and process pool modules from
+CurioQueuePkg, so run it from the top of the repository as:
+python -m Curio_demo_pkg.curio_demo_13
 """
 
 import curio
 import signal
 import time
+from curio.meta import finalize
+from functools import partial
+
+from CurioQueuePkg.ConcurrentMap import map_ordered
+from CurioQueuePkg.FibCompute import fib
+from CurioQueuePkg.WorkerPool import get_shared_pool
 
 # an event object for tracking permission from the parent
 start_evt = curio.Event()
@@ -43,17 +53,6 @@ async def friend(name):
         print(f'{name} going home')
         raise
 
-def fib(n):
-    """
-    Compute the n'th Fibonacci number.
-    :param n: target Fibonacci number
-    :return: the appropriate number
-    """
-    if n <=2:
-        return 1
-    else:
-        return fib(n-1) + fib(n-2)
-
 
 async def kid():
     """
@@ -95,12 +94,20 @@ async def kid():
         await f.spawn(friend, 'Lillian')
         await f.spawn(friend, 'Thomas')
         try:
+            pool = get_shared_pool()
+            await pool.warm_up()
             total = 0
-            for fib_nbr in range(50):
-                total += await curio.run_in_process(fib, fib_nbr)
-                print(f'Total so far is {total} for {fib_nbr}')
-                # rest a bit
-                await curio.run_in_thread(time.sleep, fib_nbr)
+            fib_results = map_ordered(partial(pool.run, fib), range(50),
+                                      limit=pool.workers)
+            async with finalize(fib_results) as fib_results:
+                async for fib_nbr, fib_value in fib_results:
+                    total += fib_value
+                    print(f'Total so far is {total} for {fib_nbr}')
+                    # rest a bit
+                    await curio.run_in_thread(time.sleep, fib_nbr)
+            stats = pool.dispatch_stats()
+            print(f'{stats["calls"]} calls cost {stats["compute_time"]:.4f}s '
+                  f'computing and {stats["overhead"]:.4f}s dispatching')
             await curio.sleep(1000)
         except curio.CancelledError as xcp:
             print('Fine. Saving my work.')
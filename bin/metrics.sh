@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# bash script to fetch the pipeline metrics while CurioQueue is running
+# (pass json to get /metrics.json instead of the Prometheus text)
+if [ "$1" == "json" ]; then
+    path=metrics.json
+else
+    path=metrics
+fi
+echo curl -s http://127.0.0.1:${METRICS_PORT:-9123}/${path}
+curl -s http://127.0.0.1:${METRICS_PORT:-9123}/${path}
+
+# EOF
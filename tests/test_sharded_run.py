@@ -0,0 +1,58 @@
+"""
+test_sharded_run.py - Check a sharded run finishes, and fails rather than
+hangs when a shard cannot start.
+"""
+
+import pytest
+from curio import run, timeout_after
+
+from CurioQueuePkg.CorpusSource import CorpusSourceClass
+from CurioQueuePkg.ShardedRun import ShardedRunClass
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+# longest a run may take before it is taken to have hung
+RUN_SECONDS = 120
+
+
+@pytest.fixture
+def corpus_path(tmp_path):
+    """
+    A corpus large enough to fill a small ring many times over.
+
+    :param tmp_path: pytest's temporary directory
+    :return: path of the corpus file
+    """
+    path = tmp_path / 'corpus.txt'
+    path.write_text('good gem clock quantum baad\n' * 20000)
+    return str(path)
+
+
+def test_sharded_run_checks_every_word(corpus_path):
+    """
+    Every word routed to a shard is checked and counted once.
+    """
+    sharded_run = ShardedRunClass(CorpusSourceClass(corpus_path), shards=2,
+                                  ring_capacity=4096)
+    merged = run(timeout_after, RUN_SECONDS, sharded_run.run_shards)
+    assert merged['shards'] == 2
+    assert merged['words'] == 100000
+    assert merged['words_checked'] == 100000
+    assert sum(sharded_run.words_routed) == 100000
+
+
+def test_failing_shard_stops_the_run(corpus_path):
+    """
+    A shard that cannot start raises its error instead of leaving the
+    router waiting on the shard's full ring.
+    """
+    sharded_run = ShardedRunClass(CorpusSourceClass(corpus_path), shards=2,
+                                  snapshot_path='/nonexistent.snap',
+                                  ring_capacity=4096)
+    with pytest.raises(FileNotFoundError):
+        run(timeout_after, RUN_SECONDS, sharded_run.run_shards)
+
+# EOF
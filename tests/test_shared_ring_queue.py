@@ -0,0 +1,156 @@
+"""
+test_shared_ring_queue.py - Check the shared memory ring between curio
+kernels: wrapping, waiting on a full ring, closing and cleaning up.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+from curio import run, sleep, spawn, timeout_after
+
+from CurioQueuePkg.CurioQueue import CurioQueueClosedError
+from CurioQueuePkg.SharedRingQueue import RECORD_LENGTH
+from CurioQueuePkg.SharedRingQueue import SharedRingQueueClass
+from CurioQueuePkg.SharedRingQueue import _count_messages, _send_messages
+
+__author__ = 'Travis Risner'
+__project__ = "PlayCurio"
+__creation_date__ = "02/02/2018"
+# "${CopyRight.py}"
+
+
+def _count_in_process(name: str) -> int:
+    """
+    Take messages off a ring until it is closed.  Runs in a child process.
+
+    :param name: shared memory name of the ring
+    :return: the number of messages taken
+    """
+    return run(_count_messages, name)
+
+
+@pytest.fixture
+def make_ring():
+    """
+    Create rings for a test and unlink whatever the test leaves behind.
+
+    :return: function taking SharedRingQueueClass keyword arguments
+    """
+    rings = []
+
+    def make(**kwargs) -> SharedRingQueueClass:
+        ring = SharedRingQueueClass(**kwargs)
+        rings.append(ring)
+        return ring
+
+    yield make
+    for ring in rings:
+        if ring.buf is not None:
+            ring.unlink()
+
+
+def test_records_wrap_round_the_end(make_ring):
+    """
+    Records, and their length prefixes, split across the end of the ring
+    come back whole and in order.
+    """
+    ring = make_ring(capacity=32)
+    # record sizes that walk every offset, so some length prefixes and
+    # some messages are cut in two by the end of the ring
+    messages = ['x' * (size % 17) for size in range(100)]
+
+    async def main():
+        received = []
+        for message in messages:
+            await ring.put(message)
+            received.append(await ring.get())
+        return received
+
+    assert run(main) == messages
+    assert ring._field('head') > 10 * ring.capacity
+    assert ring._field('head') == ring._field('tail')
+    assert ring.qsize() == 0
+
+
+def test_full_ring_put_waits_and_is_woken(make_ring):
+    """
+    A put on a full ring waits until a get makes room and is woken by it
+    rather than by polling.
+    """
+    # the poll is far longer than the test allows, so only a wakeup
+    # through the pipe can free the putter in time
+    ring = make_ring(capacity=64, poll_interval=30.0)
+    message = 'word'
+    record_size = RECORD_LENGTH.size + len('"word"')
+
+    async def main():
+        for _ in range(ring.capacity // record_size):
+            await ring.put(message)
+        putter = await spawn(ring.put, message)
+        await sleep(0.2)
+        assert not putter.terminated
+        assert ring._field('putter_waiting') == 1
+        assert await ring.get() == message
+        await timeout_after(5, putter.join)
+        return
+
+    run(main)
+    assert ring.put_blocked_count == 1
+    assert ring.wakeups_sent >= 1
+    assert ring.qsize() == 64 // record_size
+
+
+def test_get_after_close_on_drained_ring(make_ring):
+    """
+    Messages put before the ring was closed can still be taken; after
+    that get, and any put, raise.
+    """
+    ring = make_ring(capacity=256)
+
+    async def main():
+        await ring.put([1, 'one'])
+        await ring.put([2, 'two'])
+        await ring.close()
+        assert await ring.get() == [1, 'one']
+        assert await ring.get() == [2, 'two']
+        with pytest.raises(CurioQueueClosedError):
+            await ring.get()
+        with pytest.raises(CurioQueueClosedError):
+            await ring.put([3, 'three'])
+        return
+
+    run(main)
+
+
+def test_unlink_removes_segment_and_pipes(make_ring):
+    """
+    Unlinking the ring removes its shared memory and both wake pipes.
+    """
+    ring = make_ring(capacity=256)
+    name = ring.name
+    wake_paths = ring._wake_paths(name)
+    assert all(os.path.exists(path) for path in wake_paths)
+    ring.unlink()
+    assert not any(os.path.exists(path) for path in wake_paths)
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+
+
+def test_messages_reach_another_process(make_ring):
+    """
+    Every message put goes to a consumer in another process, through a
+    ring small enough to fill many times over.
+    """
+    ring = make_ring(capacity=4096)
+    messages = 20000
+    with ProcessPoolExecutor(max_workers=1,
+                             mp_context=get_context('spawn')) as executor:
+        consumer = executor.submit(_count_in_process, ring.name)
+        run(timeout_after, 60, _send_messages, ring, messages)
+        assert consumer.result(timeout=60) == messages
+    assert ring.put_blocked_count > 0
+
+# EOF